@@ -0,0 +1,115 @@
+"""
+Benchmark InvertedIndex build and BM25 queries on a synthetic corpus.
+
+Comments are drawn from a Zipf-distributed vocabulary and split into
+fixed-size drug ranges, mimicking the store layout. Run from the repository
+root:
+
+    python benchmarks/bench_lexical_index.py --n_comments 1000000
+"""
+
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src.side_effect.lexical_index import InvertedIndex
+
+
+def term(rank):
+    """
+    Letters-only token of a frequency rank ('ka', 'kb', ...), which survives
+    the keyword preprocessing of InvertedIndex.bm25 unchanged.
+    """
+    letters = ""
+    while True:
+        rank, digit = divmod(rank, 26)
+        letters = chr(ord("a") + digit) + letters
+        if rank == 0:
+            return "k" + letters
+
+
+def zipf_corpus(
+    n_comments, vocab_size=30000, min_tokens=20, max_tokens=80, exponent=1.1, seed=0
+):
+    """
+    Synthetic cleaned comments whose tokens follow a Zipf law over the
+    vocabulary (term(0) is the most frequent term).
+    :param n_comments: Number of comments.
+    :param vocab_size: Number of distinct terms.
+    :param min_tokens: Minimum comment length in tokens.
+    :param max_tokens: Maximum comment length in tokens.
+    :param exponent: Zipf exponent.
+    :param seed: Random seed.
+    :return: Object array of comments.
+    """
+    rng = np.random.default_rng(seed)
+    probabilities = 1.0 / np.arange(1, vocab_size + 1) ** exponent
+    probabilities /= probabilities.sum()
+    terms = np.array([term(rank) for rank in range(vocab_size)], dtype=object)
+    lengths = rng.integers(min_tokens, max_tokens + 1, n_comments)
+    tokens = terms[rng.choice(vocab_size, lengths.sum(), p=probabilities)]
+    bounds = np.concatenate([[0], np.cumsum(lengths)])
+    return np.array(
+        [" ".join(tokens[bounds[i] : bounds[i + 1]]) for i in range(n_comments)],
+        dtype=object,
+    )
+
+
+def timed(fn, repeats=1):
+    """
+    Best wall time of fn over repeats, with its last result.
+    """
+    best, result = float("inf"), None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--n_comments", type=int, default=1000000)
+    parser.add_argument("--vocab_size", type=int, default=30000)
+    parser.add_argument("--drug_rows", type=int, default=5000)
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    seconds, comments = timed(
+        lambda: zipf_corpus(args.n_comments, args.vocab_size, seed=args.seed)
+    )
+    print(f"Generated {len(comments)} comments in {seconds:.1f} s")
+    groups = np.arange(len(comments)) // args.drug_rows
+
+    seconds, index = timed(lambda: InvertedIndex(comments, groups))
+    nbytes = sum(
+        array.nbytes
+        for array in (index.doc_ids, index.tf, index.term_ptr, index.doc_lengths)
+    )
+    print(
+        f"Build: {seconds:.1f} s, {len(index.doc_ids)} postings, "
+        f"{nbytes / 2**20:.0f} MB of arrays, {len(index.vocabulary)} terms"
+    )
+
+    # Keywords of a few frequency ranks, as expanded keywords span common and
+    # rare terms
+    queries = [term(rank) for rank in (10, 100, 1000, 10000)]
+    start, stop = args.drug_rows, 2 * args.drug_rows
+    for query in queries:
+        full, _ = timed(lambda: index.bm25(query), args.repeats)
+        drug, _ = timed(lambda: index.bm25(query, start, stop), args.repeats)
+        print(
+            f"BM25 {query} (df={index.doc_freq[index.vocabulary[query]]}): "
+            f"full corpus {full * 1e3:.2f} ms, one drug {drug * 1e3:.3f} ms"
+        )
+    seconds, _ = timed(lambda: index.term_stats(1))
+    print(f"Per-drug term_stats: {seconds:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,46 @@
 import numpy as np
+import pandas as pd
+from statistics import NormalDist
 from sklearn.metrics.pairwise import cosine_similarity
 from src.side_effect.embedding_and_keywords import BioBERTEmbedder
+from src.side_effect.comment_store import DrugView
+from src.side_effect.tdigest import TDigest
 
-embedder = BioBERTEmbedder()
+_embedder = None
+
+
+def default_embedder():
+    """
+    BioBERTEmbedder of the default model, loaded on first use. Callers with their
+    own model (e.g. SideEffectAnalyzer) pass their embedder instead, so keywords
+    and comments are embedded in the same space.
+    """
+    global _embedder
+    if _embedder is None:
+        _embedder = BioBERTEmbedder()
+    return _embedder
+
+
+def __getattr__(name):
+    # Keep analysis.embedder working without loading the model at import
+    if name == "embedder":
+        return default_embedder()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def get_comment_similarity(
-    initial_kw, expanded_keywords, comment_embeddings, threshold=0.5
+    initial_kw, expanded_keywords, comment_embeddings, threshold=0.5, embedder=None
 ):
     """
     Calculate similarity between expanded keywords and comments.
     :param initial_kw: The initial keyword being analyzed.
     :param expanded_keywords: Dictionary of expanded keywords and their similarity scores.
     :param comment_embeddings: List of comment embeddings.
+    :param embedder: BioBERTEmbedder that embedded the comments; defaults to
+                     default_embedder().
     :return: Dictionary of keyword-comment similarities.
     """
+    embedder = embedder or default_embedder()
     exp_kw = [list(item.keys())[0] for item in expanded_keywords[initial_kw]]
     # kw_embeddings = {kw: get_embeddings(kw)[0] for kw in exp_kw}
     kw_embeddings = {kw: embedder.get_embeddings(kw)[0] for kw in exp_kw}
@@ -44,42 +70,525 @@ def evaluate_score(comment_similarity, initial_kw, expanded_keywords):
     return score
 
 
-def comment_side_effect(
-    comment_similarity, initial_kw, expanded_keywords, drug_dict, top_k=10
+def weighted_comment_scores(
+    comment_similarity, initial_kw, expanded_keywords, n_comments
 ):
     """
-    Match comments with side effects and rank them by relevance.
+    Combine keyword-comment similarities into one score per comment, weighting each
+    expanded keyword by its similarity to the initial keyword.
     :param comment_similarity: Dictionary of keyword-comment similarities.
     :param initial_kw: The initial keyword.
     :param expanded_keywords: Dictionary of expanded keywords and their similarity scores.
-    :param drug_dict: List of dictionaries containing drug metadata.
-    :param top_k: Maximum number of comments to return.
-    :return: Updated drug_dict and top K comments related to the side effect.
+    :param n_comments: Number of comments.
+    :return: NumPy array of comment scores.
     """
     exp_kw_emb_dict = expanded_keywords[initial_kw]
     exp_kw = [list(item.keys())[0] for item in expanded_keywords[initial_kw]]
-    # scores = [0 for _ in range(len(drug_dict))]
-    scores = np.zeros(len(drug_dict))
+    scores = np.zeros(n_comments)
     for kw in exp_kw:
         word_score = next(item[kw] for item in exp_kw_emb_dict if kw in item)
-        # comment_score = comment_similarity[kw]
         comment_score = np.array(comment_similarity[kw])
-        # scores = list(np.array(scores) + np.array(word_score * comment_score))
         scores += word_score * comment_score
+    return scores
+
+
+def comment_side_effect(
+    comment_similarity,
+    initial_kw,
+    expanded_keywords,
+    drug_dict,
+    top_k=10,
+    rerank_fn=None,
+    rerank_depth=50,
+):
+    """
+    Match comments with side effects and rank them by relevance.
+    :param comment_similarity: Dictionary of keyword-comment similarities.
+    :param initial_kw: The initial keyword.
+    :param expanded_keywords: Dictionary of expanded keywords and their similarity scores.
+    :param drug_dict: List of dictionaries containing drug metadata, or a DrugView.
+    :param top_k: Maximum number of comments to return.
+    :param rerank_fn: Optional callable returning exact comment scores for an array
+                      of comment indices, used when comment_similarity is
+                      approximate: the best rerank_depth comments are rescored and
+                      the top K is taken from them.
+    :param rerank_depth: Number of approximate candidates rescored by rerank_fn.
+    :return: Updated drug_dict and top K comments related to the side effect.
+    """
+    scores = weighted_comment_scores(
+        comment_similarity, initial_kw, expanded_keywords, len(drug_dict)
+    )
     upper_quartile = np.percentile(scores, 50)
-    comment_idx = [i for i in range(len(scores)) if scores[i] >= upper_quartile]
-    top_k_comments = []
-    for idx in comment_idx:
-        drug_dict[idx]["side_effects"].append(initial_kw)
-        top_k_comments.append(
-            {
-                "drug": drug_dict[idx]["Drug Name"],
-                "side_effect": initial_kw,
-                "comment": drug_dict[idx]["Review Text"],
-                "score": scores[idx],
-            }
+    comment_idx = np.flatnonzero(scores >= upper_quartile)
+    # Highest scores first; stable so ties keep comment order
+    ranked = comment_idx[np.argsort(-scores[comment_idx], kind="stable")]
+    top_idx = ranked[:top_k]
+    if rerank_fn is not None and len(ranked):
+        candidates = ranked[: max(top_k, rerank_depth)]
+        exact = rerank_fn(candidates)
+        keep = np.argsort(-exact, kind="stable")[:top_k]
+        top_idx = candidates[keep]
+        scores = scores.copy()
+        scores[top_idx] = exact[keep]
+    if isinstance(drug_dict, DrugView):
+        drug_dict.add_side_effect(comment_idx, initial_kw)
+        drug_names = drug_dict.drug_names[top_idx]
+        review_text = drug_dict.review_text[top_idx]
+    else:
+        for idx in comment_idx:
+            drug_dict[idx]["side_effects"].append(initial_kw)
+        drug_names = [drug_dict[idx]["Drug Name"] for idx in top_idx]
+        review_text = [drug_dict[idx]["Review Text"] for idx in top_idx]
+    top_k_comments = [
+        {
+            "drug": drug,
+            "side_effect": initial_kw,
+            "comment": comment,
+            "score": scores[idx],
+        }
+        for drug, comment, idx in zip(drug_names, review_text, top_idx)
+    ]
+    return drug_dict, top_k_comments
+
+
+def get_static_similarity(
+    initial_kw, expanded_keywords, static_comment_embeddings, embedder=None
+):
+    """
+    Cheap first-stage similarity between expanded keywords and comments, computed
+    on static (input token) embeddings instead of contextual BioBERT embeddings.
+    :param initial_kw: The initial keyword being analyzed.
+    :param expanded_keywords: Dictionary of expanded keywords and their similarity scores.
+    :param static_comment_embeddings: Static comment embeddings.
+    :param embedder: BioBERTEmbedder that embedded the comments; defaults to
+                     default_embedder().
+    :return: Dictionary of keyword-comment similarities.
+    """
+    exp_kw = [list(item.keys())[0] for item in expanded_keywords[initial_kw]]
+    if not exp_kw:
+        return {}
+    embedder = embedder or default_embedder()
+    kw_embeddings = embedder.get_static_embeddings(exp_kw)
+    similarities = cosine_similarity(kw_embeddings, static_comment_embeddings)
+    return dict(zip(exp_kw, similarities))
+
+
+def cascade_candidates(static_similarities, expanded_keywords, fraction, n_comments):
+    """
+    Select the comments that deserve a full BioBERT forward pass: the union over
+    side effects of the top fraction of comments by first-stage score.
+    :param static_similarities: Dictionary mapping each initial keyword to its
+                                static keyword-comment similarities.
+    :param expanded_keywords: Dictionary of expanded keywords and their similarity scores.
+    :param fraction: Fraction of comments kept per side effect.
+    :param n_comments: Number of comments.
+    :return: Sorted NumPy array of candidate comment indices.
+    """
+    n_keep = min(n_comments, max(2, int(np.ceil(fraction * n_comments))))
+    candidates = np.zeros(n_comments, dtype=bool)
+    for initial_kw, similarity in static_similarities.items():
+        scores = weighted_comment_scores(
+            similarity, initial_kw, expanded_keywords, n_comments
         )
-    return (
-        drug_dict,
-        sorted(top_k_comments, key=lambda x: x["score"], reverse=True)[:top_k],
+        candidates[np.argsort(-scores, kind="stable")[:n_keep]] = True
+    return np.flatnonzero(candidates)
+
+
+def fill_similarity(candidate_similarity, static_similarity, candidates, n_comments):
+    """
+    Expand similarities computed on the candidate comments to all comments.
+    Non-candidates get their first-stage similarity mapped through a per-keyword
+    linear fit of exact on static similarity over the candidates, capped at the
+    lowest candidate similarity so they never outrank a scored candidate.
+    :param candidate_similarity: Keyword-comment similarities for the candidates.
+    :param static_similarity: Static keyword-comment similarities for all comments.
+    :param candidates: Indices of the candidate comments.
+    :param n_comments: Total number of comments.
+    :return: Dictionary of keyword-comment similarities for all comments.
+    """
+    others = np.setdiff1d(np.arange(n_comments), candidates)
+    filled = {}
+    for kw, exact in candidate_similarity.items():
+        full = np.empty(n_comments)
+        full[candidates] = exact
+        static = static_similarity[kw]
+        if len(others):
+            if np.ptp(static[candidates]) > 0:
+                slope, intercept = np.polyfit(static[candidates], exact, 1)
+            else:
+                slope, intercept = 0.0, np.mean(exact)
+            full[others] = np.minimum(slope * static[others] + intercept, exact.min())
+        filled[kw] = full
+    return filled
+
+
+def cascade_recall(
+    exact_similarities, candidates, expanded_keywords, n_comments, top_k=10
+):
+    """
+    Fraction of the exact top-k comments of each side effect that the cascade keeps
+    as candidates, averaged over side effects.
+    :param exact_similarities: Dictionary mapping each initial keyword to its exact
+                               keyword-comment similarities.
+    :param candidates: Indices of the candidate comments.
+    :param expanded_keywords: Dictionary of expanded keywords and their similarity scores.
+    :param n_comments: Number of comments.
+    :param top_k: Number of top comments compared.
+    :return: Mean recall.
+    """
+    recalls = []
+    for initial_kw, similarity in exact_similarities.items():
+        scores = weighted_comment_scores(
+            similarity, initial_kw, expanded_keywords, n_comments
+        )
+        top = np.argsort(-scores, kind="stable")[:top_k]
+        recalls.append(np.isin(top, candidates).mean())
+    return float(np.mean(recalls))
+
+
+def tune_cascade_fraction(
+    static_similarities,
+    exact_similarities,
+    expanded_keywords,
+    n_comments,
+    target_recall=0.95,
+    fractions=(0.05, 0.1, 0.2, 0.3, 0.5, 0.75),
+    top_k=10,
+):
+    """
+    Pick the smallest cascade fraction whose top-k recall against the exact path
+    reaches the target, using one drug scored both ways.
+    :param static_similarities: Static similarities per initial keyword.
+    :param exact_similarities: Exact similarities per initial keyword.
+    :param expanded_keywords: Dictionary of expanded keywords and their similarity scores.
+    :param n_comments: Number of comments of the drug.
+    :param target_recall: Minimum mean top-k recall.
+    :param fractions: Candidate fractions, tried in increasing order.
+    :param top_k: Number of top comments compared.
+    :return: Tuple (fraction, dictionary of recall per tried fraction).
+    """
+    report = {}
+    for fraction in sorted(fractions):
+        candidates = cascade_candidates(
+            static_similarities, expanded_keywords, fraction, n_comments
+        )
+        report[fraction] = cascade_recall(
+            exact_similarities, candidates, expanded_keywords, n_comments, top_k
+        )
+        if report[fraction] >= target_recall:
+            return fraction, report
+    return 1.0, report
+
+
+def get_lexical_scores(index, initial_kw, expanded_keywords, start=0, stop=None):
+    """
+    Lexical relevance of comments to a side effect: BM25 scores of the expanded
+    keywords, weighted like the embedding similarities.
+    :param index: InvertedIndex over the cleaned comments.
+    :param initial_kw: The initial keyword being analyzed.
+    :param expanded_keywords: Dictionary of expanded keywords and their similarity scores.
+    :param start: First row of the drug in the index.
+    :param stop: End row of the drug in the index (exclusive).
+    :return: NumPy array of comment scores, 0 for comments without any keyword token.
+    """
+    stop = len(index) if stop is None else stop
+    exp_kw = [list(item.keys())[0] for item in expanded_keywords[initial_kw]]
+    bm25 = {kw: index.bm25(kw, start, stop) for kw in exp_kw}
+    return weighted_comment_scores(bm25, initial_kw, expanded_keywords, stop - start)
+
+
+def hybrid_candidates(
+    lexical_scores, static_similarities, expanded_keywords, budget, n_comments
+):
+    """
+    Select the comments that get a full BioBERT forward pass in hybrid mode: every
+    lexical hit of any side effect, plus a small budget of comments ranked by
+    static embedding similarity to catch matches without shared tokens.
+    :param lexical_scores: Dictionary mapping each initial keyword to its lexical
+                           comment scores.
+    :param static_similarities: Dictionary mapping each initial keyword to its
+                                static keyword-comment similarities.
+    :param expanded_keywords: Dictionary of expanded keywords and their similarity scores.
+    :param budget: Fraction of comments per side effect added by static similarity.
+    :param n_comments: Number of comments.
+    :return: Sorted NumPy array of candidate comment indices.
+    """
+    hits = np.zeros(n_comments, dtype=bool)
+    for scores in lexical_scores.values():
+        hits |= scores > 0
+    semantic = cascade_candidates(
+        static_similarities, expanded_keywords, budget, n_comments
+    )
+    return np.union1d(np.flatnonzero(hits), semantic)
+
+
+def keyword_weight_matrix(initial_keywords, expanded_keywords, embedder=None):
+    """
+    Embed all expanded keywords once and build the matrix that turns
+    keyword-comment similarities into weighted side effect scores.
+    :param initial_keywords: List of initial keywords.
+    :param expanded_keywords: Dictionary of expanded keywords and their similarity scores.
+    :param embedder: BioBERTEmbedder that embeds the comments; defaults to
+                     default_embedder().
+    :return: Tuple (normalized keyword embeddings of shape (n_exp_kw, dim),
+             weights of shape (n_exp_kw, n_initial_kw)).
+    """
+    exp_kw = sorted(
+        {
+            list(item.keys())[0]
+            for kw in initial_keywords
+            for item in expanded_keywords[kw]
+        }
+    )
+    kw_index = {kw: i for i, kw in enumerate(exp_kw)}
+    weights = np.zeros((len(exp_kw), len(initial_keywords)))
+    for col, initial_kw in enumerate(initial_keywords):
+        for item in expanded_keywords[initial_kw]:
+            kw, word_score = next(iter(item.items()))
+            weights[kw_index[kw], col] = word_score
+    embedder = embedder or default_embedder()
+    if not exp_kw:
+        return np.zeros((0, embedder.model.config.hidden_size)), weights
+    kw_embeddings = np.vstack([embedder.get_embeddings(kw)[0] for kw in exp_kw])
+    kw_embeddings /= np.linalg.norm(kw_embeddings, axis=1, keepdims=True)
+    return kw_embeddings, weights
+
+
+def tile_rows_for_budget(memory_budget_mb, dim, n_exp_kw, n_initial_kw):
+    """
+    Number of comments per tile that keeps tiled scoring within a memory budget.
+    :param memory_budget_mb: Memory budget in megabytes.
+    :param dim: Embedding dimension.
+    :param n_exp_kw: Number of expanded keywords.
+    :param n_initial_kw: Number of initial keywords.
+    :return: Rows per tile (at least 1).
+    """
+    row_bytes = 8 * (dim + n_exp_kw + 2 * n_initial_kw)
+    return max(1, int(memory_budget_mb * 2**20) // row_bytes)
+
+
+def iter_tile_scores(embeddings, kw_embeddings, weights, tile_rows):
+    """
+    Stream weighted side effect scores over fixed-size tiles of comment embeddings.
+    :param embeddings: Array-like of shape (n_comments, dim), e.g. a np.memmap.
+    :param kw_embeddings: Normalized keyword embeddings.
+    :param weights: Keyword weight matrix from keyword_weight_matrix.
+    :param tile_rows: Number of comments per tile.
+    :return: Generator of (first row, scores of shape (tile, n_initial_kw)).
+    """
+    for start in range(0, len(embeddings), tile_rows):
+        tile = np.asarray(embeddings[start : start + tile_rows], dtype=np.float64)
+        norms = np.linalg.norm(tile, axis=1, keepdims=True)
+        tile /= np.where(norms == 0, 1, norms)
+        yield start, (tile @ kw_embeddings.T) @ weights
+
+
+def out_of_core_side_effects(
+    embeddings,
+    initial_keywords,
+    expanded_keywords,
+    memory_budget_mb=512,
+    top_k=10,
+    compression=200,
+    assign_fn=None,
+    embedder=None,
+):
+    """
+    Score comments against side effects without holding a drug's embeddings or
+    score vectors in memory. The first pass over tiles accumulates score sums,
+    a t-digest per side effect for the median threshold and a running top-k;
+    the second pass assigns side effects to comments above the threshold.
+    :param embeddings: Array-like of shape (n_comments, dim), e.g. a np.memmap.
+    :param initial_keywords: List of initial keywords.
+    :param expanded_keywords: Dictionary of expanded keywords and their similarity scores.
+    :param memory_budget_mb: Memory budget for one tile in megabytes.
+    :param top_k: Number of top comments kept per side effect.
+    :param compression: t-digest compression (higher is more accurate).
+    :param assign_fn: Callable (comment indices, initial keyword) receiving each tile's
+                      assignments, e.g. DrugView.add_side_effect. If None, they are
+                      collected and returned.
+    :param embedder: BioBERTEmbedder that embedded the comments; defaults to
+                     default_embedder().
+    :return: Tuple (scores, top_k, assignments): dictionaries keyed by initial keyword
+             holding the mean score, a list of (comment index, score) pairs and, if
+             assign_fn is None, the array of comment indices at or above the
+             estimated median.
+    """
+    kw_embeddings, weights = keyword_weight_matrix(
+        initial_keywords, expanded_keywords, embedder
     )
+    tile_rows = tile_rows_for_budget(
+        memory_budget_mb, embeddings.shape[1], len(kw_embeddings), len(initial_keywords)
+    )
+    n_initial = len(initial_keywords)
+    sums = np.zeros(n_initial)
+    digests = [TDigest(compression) for _ in range(n_initial)]
+    top_idx = [np.empty(0, dtype=np.int64) for _ in range(n_initial)]
+    top_scores = [np.empty(0) for _ in range(n_initial)]
+
+    for start, scores in iter_tile_scores(
+        embeddings, kw_embeddings, weights, tile_rows
+    ):
+        sums += scores.sum(axis=0)
+        rows = np.arange(start, start + len(scores))
+        for col in range(n_initial):
+            digests[col].update(scores[:, col])
+            idx = np.concatenate([top_idx[col], rows])
+            tile_top = np.concatenate([top_scores[col], scores[:, col]])
+            # Highest scores first, ties broken by comment order
+            keep = np.lexsort((idx, -tile_top))[:top_k]
+            top_idx[col], top_scores[col] = idx[keep], tile_top[keep]
+
+    thresholds = np.array([digest.quantile(0.5) for digest in digests])
+    assignments = {kw: [] for kw in initial_keywords}
+    if assign_fn is None:
+        assign_fn = lambda idx, kw: assignments[kw].append(idx)  # noqa: E731
+    for start, scores in iter_tile_scores(
+        embeddings, kw_embeddings, weights, tile_rows
+    ):
+        for col, kw in enumerate(initial_keywords):
+            assign_fn(start + np.flatnonzero(scores[:, col] >= thresholds[col]), kw)
+
+    n_comments = max(len(embeddings), 1)
+    side_effect_scores, top_k_comments = {}, {}
+    for col, kw in enumerate(initial_keywords):
+        side_effect_scores[kw] = sums[col] / n_comments
+        above = top_scores[col] >= thresholds[col]
+        top_k_comments[kw] = list(zip(top_idx[col][above], top_scores[col][above]))
+        if assignments[kw]:
+            assignments[kw] = np.concatenate(assignments[kw])
+    return side_effect_scores, top_k_comments, assignments
+
+
+def stratify(lengths, sources=None, n_length_bins=4):
+    """
+    Assign comments to sampling strata by length quantile and, if given, source.
+    :param lengths: Array of comment lengths in words.
+    :param sources: Optional array with the source of each comment.
+    :param n_length_bins: Number of length quantile bins.
+    :return: Array of stratum ids in 0..n_strata - 1.
+    """
+    lengths = np.asarray(lengths)
+    edges = np.quantile(lengths, np.linspace(0, 1, n_length_bins + 1)[1:-1])
+    strata = np.searchsorted(edges, lengths, side="right")
+    if sources is not None:
+        source_codes, _ = pd.factorize(np.asarray(sources))
+        strata = source_codes * n_length_bins + strata
+    return pd.factorize(strata)[0]
+
+
+def stratified_sample_order(strata, seed=0):
+    """
+    Random order of comments in which every prefix is a nearly proportional
+    stratified sample: the i-th comment of a stratum of size N_h is placed
+    around position i / N_h of the order. One comment of every stratum comes
+    first, so any prefix of at least n_strata comments samples every stratum.
+    :param strata: Array of stratum ids.
+    :param seed: Random seed.
+    :return: Array of comment indices.
+    """
+    rng = np.random.default_rng(seed)
+    perm = rng.permutation(len(strata))
+    perm = perm[np.argsort(strata[perm], kind="stable")]
+    sizes = np.bincount(strata)
+    rank = np.arange(len(perm)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    keys = (rank + rng.random(len(perm))) / sizes[strata[perm]]
+    keys[rank == 0] -= 1
+    return perm[np.argsort(keys, kind="stable")]
+
+
+def stratified_mean(values, sample_strata, stratum_sizes):
+    """
+    Stratified estimate of the mean of each column over all comments, with its
+    standard error (finite population corrected). Strata without sampled
+    comments cannot be estimated; the sampled strata are reweighted to cover
+    all comments, which is unbiased only if the missing strata have the same
+    mean, so samplers should include every stratum (see
+    stratified_sample_order).
+    :param values: Array of shape (n_sampled, n_columns).
+    :param sample_strata: Stratum id of each sampled comment.
+    :param stratum_sizes: Number of comments in each stratum.
+    :return: Tuple (means, standard errors), arrays of shape (n_columns,).
+    """
+    n_h = np.bincount(sample_strata, minlength=len(stratum_sizes))
+    sampled = n_h > 0
+    weights = np.where(sampled, stratum_sizes, 0) / stratum_sizes[sampled].sum()
+    sums = np.zeros((len(stratum_sizes), values.shape[1]))
+    squares = np.zeros_like(sums)
+    np.add.at(sums, sample_strata, values)
+    np.add.at(squares, sample_strata, values**2)
+    n = np.maximum(n_h, 1)[:, None]
+    means = sums / n
+    variances = np.maximum(squares - n * means**2, 0) / np.maximum(n - 1, 1)
+    # Strata with a single sampled comment borrow the pooled variance
+    pooled = values.var(axis=0, ddof=1) if len(values) > 1 else np.zeros(len(sums[0]))
+    variances[n_h == 1] = pooled
+    fpc = 1 - n_h / np.maximum(stratum_sizes, 1)
+    se = np.sqrt(((weights**2 * fpc / n[:, 0])[:, None] * variances).sum(axis=0))
+    return weights @ means, se
+
+
+def ranking_is_stable(means, lower, upper, k):
+    """
+    Whether the order of the top-k and tail-k ranks is determined by the
+    confidence intervals: each of the first k scores must lie above every
+    lower-ranked score, and each of the last k below every higher-ranked one,
+    interval against interval. With fewer than k scores the whole ranking must
+    be determined.
+    :param means: Estimated scores.
+    :param lower: Lower confidence bounds.
+    :param upper: Upper confidence bounds.
+    :param k: Number of top and tail ranks.
+    :return: True if both rankings are determined at the interval's confidence.
+    """
+    order = np.argsort(-means, kind="stable")
+    lower, upper = np.asarray(lower)[order], np.asarray(upper)[order]
+    k = min(k, len(order) - 1)
+    if k < 1:
+        return True
+    # Highest upper bound among the ranks below each rank, lowest lower bound
+    # among the ranks above it
+    upper_below = np.maximum.accumulate(upper[::-1])[::-1][1:]
+    lower_above = np.minimum.accumulate(lower)[:-1]
+    top_stable = np.all(lower[:k] > upper_below[:k])
+    tail_stable = np.all(upper[-k:] < lower_above[-k:])
+    return bool(top_stable and tail_stable)
+
+
+def sampled_side_effects(
+    score_fn, strata, initial_keywords, k=5, confidence=0.95, initial_size=200, seed=0
+):
+    """
+    Estimate side effect scores from a growing stratified sample of comments,
+    doubling the sample until the order of the top-k and tail-k side effects is
+    determined by their confidence intervals (or every comment is scored, which
+    is exact).
+    :param score_fn: Callable mapping an array of comment indices to their weighted
+                     side effect scores, of shape (len(indices), n_initial_kw).
+    :param strata: Array of stratum ids of all comments, e.g. from stratify.
+    :param initial_keywords: List of initial keywords.
+    :param k: Size of the top and tail rankings that must be stable.
+    :param confidence: Confidence level of the intervals.
+    :param initial_size: Size of the first sample.
+    :param seed: Random seed of the sample order.
+    :return: Tuple (scores, intervals, sample, sample_scores): dictionaries keyed by
+             initial keyword of the estimated score and its (lower, upper) interval,
+             the sampled comment indices, and their scores.
+    """
+    n_comments = len(strata)
+    order = stratified_sample_order(strata, seed)
+    stratum_sizes = np.bincount(strata)
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    values = np.empty((0, len(initial_keywords)))
+    # The first sample includes every stratum (see stratified_sample_order)
+    size = min(n_comments, max(initial_size, len(stratum_sizes)))
+    while True:
+        values = np.vstack([values, score_fn(order[len(values) : size])])
+        means, se = stratified_mean(values, strata[order[:size]], stratum_sizes)
+        lower, upper = means - z * se, means + z * se
+        if size == n_comments or ranking_is_stable(means, lower, upper, k):
+            break
+        size = min(n_comments, 2 * size)
+    scores = dict(zip(initial_keywords, means))
+    intervals = dict(zip(initial_keywords, zip(lower, upper)))
+    return scores, intervals, order[:size], values
@@ -1,5 +1,9 @@
 import sys
 import os
+import hashlib
+import json
+import time
+import numpy as np
 import pandas as pd
 
 # 添加项目根目录到 sys.path
@@ -12,13 +16,30 @@ from src.side_effect.analysis import (
     get_comment_similarity,
     evaluate_score,
     comment_side_effect,
+    get_static_similarity,
+    cascade_candidates,
+    fill_similarity,
+    tune_cascade_fraction,
+    out_of_core_side_effects,
+    get_lexical_scores,
+    hybrid_candidates,
+    keyword_weight_matrix,
+    iter_tile_scores,
+    stratify,
+    sampled_side_effects,
+    weighted_comment_scores,
 )
+from src.side_effect.sharding import run_sharded, work_queue
 from src.side_effect.data_processing import (
     prepare_comment_dict,
+    prepare_comment_store,
+    load_reviews,
+    is_review_db,
     get_drugs,
     pick_drug,
     get_merged_data,
     get_negative_comment,
+    get_deduplicated_comment,
     prepare_comment_dict,
 )
 from src.side_effect.embedding_and_keywords import BioBERTEmbedder, KeywordExpander
@@ -27,7 +48,24 @@ from src.side_effect.analysis import (
     evaluate_score,
     comment_side_effect,
 )
+from src.side_effect.file_utils import (
+    atomic_write,
+    atomic_write_json,
+    atomic_write_csv,
+    load_json,
+    file_digest,
+    safe_filename,
+)
+from src.side_effect.review_db import ReviewDatabase
+from src.side_effect.lexical_index import InvertedIndex
+from src.side_effect.planner import plan_run, format_plan
+from src.side_effect.pq import ProductQuantizer, normalize, pq_report
+from src.side_effect.autotune import autotune
+from src.side_effect.result_cache import ResultCache
+from src.side_effect.cooccurrence import CooccurrenceStats, export_cooccurrence
+from src.side_effect.result_writers import DrugResult, get_writer, summarize_result
 import argparse
+import torch
 import logging
 
 logging.basicConfig(
@@ -49,77 +87,882 @@ class SideEffectAnalyzer:
         initial_keywords,
         side_effects_official,
         model_name="dmis-lab/biobert-base-cased-v1.2",
+        cascade=False,
+        cascade_fraction=None,
+        cascade_recall=0.95,
+        out_of_core=False,
+        memory_budget_mb=512,
+        embedding_dir="output/embeddings",
+        hybrid=False,
+        hybrid_budget=0.05,
+        approximate=False,
+        confidence=0.95,
+        sample_size=200,
+        stable_k=5,
+        pq=False,
+        pq_subspaces=48,
+        pq_rerank_depth=50,
+        pq_train_size=20000,
+        pq_report=False,
+        top_k=10,
+        result_cache=None,
     ):
         """
         Initializes the SideEffectAnalyzer with initial keywords and a BioBERT model.
         :param initial_keywords: List of initial side effect keywords.
         :param side_effects_official: List of official side effects.
         :param model_name: Name of the BioBERT model to use.
+        :param cascade: Score comments with cheap static embeddings first and run
+                        BioBERT only on the most plausible candidates.
+        :param cascade_fraction: Fraction of comments per side effect sent to BioBERT
+                                 in cascade mode. If None, it is tuned on the first
+                                 drug against the exact path.
+        :param cascade_recall: Target top-k recall used when tuning cascade_fraction.
+        :param out_of_core: Stream each drug's embeddings to a memory-mapped file and
+                            score them tile by tile, estimating the median threshold
+                            with a t-digest, so memory use stays within the budget.
+        :param memory_budget_mb: Memory budget per scoring tile in out-of-core mode.
+        :param embedding_dir: Directory of the memory-mapped embedding files.
+        :param hybrid: Run BioBERT only on comments with a lexical (BM25) hit for an
+                       expanded keyword plus a small static-embedding budget.
+        :param hybrid_budget: Fraction of comments per side effect added by static
+                              embedding similarity in hybrid mode.
+        :param approximate: Estimate each drug's scores from a stratified sample of
+                            comments, grown until the top and tail rankings are
+                            stable, and report confidence intervals.
+        :param confidence: Confidence level of the intervals in approximate mode.
+        :param sample_size: Initial sample size per drug in approximate mode.
+        :param stable_k: Size of the top and tail rankings that must be stable.
+        :param pq: Score comments against keywords from product-quantized codes of
+                   their embeddings, saved per drug for later runs; the top
+                   comments are re-embedded for an exact rerank.
+        :param pq_subspaces: Bytes per PQ code.
+        :param pq_rerank_depth: Number of PQ candidates rescored exactly per side effect.
+        :param pq_train_size: Number of corpus comments used to train the PQ codec.
+        :param pq_report: Log compression, speedup and ranking agreement with the
+                          exact path for each drug in PQ mode.
+        :param top_k: Number of top comments kept per drug and side effect.
+        :param result_cache: ResultCache reused across runs; only the (drug, side
+                             effect) pairs it misses are computed.
         """
+        if cascade + out_of_core + hybrid + approximate + pq > 1:
+            raise ValueError(
+                "cascade, out_of_core, hybrid, approximate and pq modes cannot be "
+                "combined"
+            )
         self.initial_keywords = initial_keywords
+        self.model_name = model_name
         self.embedder = BioBERTEmbedder(model_name)
         self.keyword_expander = KeywordExpander(self.embedder, side_effects_official)
+        self.cascade = cascade
+        self.cascade_fraction = cascade_fraction
+        # cascade_fraction is replaced by the tuned value after the first drug
+        self.configured_cascade_fraction = cascade_fraction
+        self.cascade_recall = cascade_recall
+        self.out_of_core = out_of_core
+        self.memory_budget_mb = memory_budget_mb
+        self.embedding_dir = embedding_dir
+        self.hybrid = hybrid
+        self.hybrid_budget = hybrid_budget
+        self.lexical_index = None
+        self.approximate = approximate
+        self.confidence = confidence
+        self.sample_size = sample_size
+        self.stable_k = stable_k
+        self.pq = pq
+        self.pq_subspaces = pq_subspaces
+        self.pq_rerank_depth = pq_rerank_depth
+        self.pq_train_size = pq_train_size
+        self.pq_report = pq_report
+        self.pq_codec = None
+        self.pq_data_version = None
+        self.pq_dir = None
+        self.top_k = top_k
+        self.result_cache = result_cache
+        self.review_db = None
+        self.data_versions = {}
+        self.n_comments = 0
+        self.n_forward_passes = 0
 
-    def process_file(self, file_path, drugs, initial_keywords):
+    def embed_comments(self, comments, review_ids=None):
         """
-        Processes a CSV file containing drug reviews.
-        :param file_path: Path to the CSV file.
-        :return: Updated comment dictionary, side effect scores, and top comments.
+        Embed comments with BioBERT. When reading from a review database, cached
+        embeddings are reused and new ones are stored.
+        :param comments: List of cleaned comments.
+        :param review_ids: Review ids of the comments in the review database.
+        :return: Array or list of comment embeddings.
         """
-        # Load and preprocess data
-        data = pd.read_csv(file_path)
+        if self.review_db is None or review_ids is None:
+            self.n_forward_passes += len(comments)
+            return self.embedder.embed_batch(comments)
 
-        # Prepare comment dictionary and drug list
-        comment_dict = prepare_comment_dict(data, "cleaned_comments")
-        self.initial_keywords = initial_keywords
+        found, cached = self.review_db.load_embeddings(review_ids, self.model_name)
+        position = {review_id: i for i, review_id in enumerate(found)}
+        missing = [
+            i for i, review_id in enumerate(review_ids) if review_id not in position
+        ]
+        new_embeddings = self.embedder.embed_batch([comments[i] for i in missing])
+        self.n_forward_passes += len(missing)
+        if missing:
+            self.review_db.save_embeddings(
+                [review_ids[i] for i in missing], new_embeddings, self.model_name
+            )
+        new_position = {i: j for j, i in enumerate(missing)}
+        return [
+            (
+                cached[position[review_id]]
+                if review_id in position
+                else new_embeddings[new_position[i]]
+            )
+            for i, review_id in enumerate(review_ids)
+        ]
+
+    def exact_similarities(self, comments, expanded_keywords, review_ids=None):
+        """
+        Embed every comment with BioBERT and compare it with the expanded keywords.
+        :param comments: List of cleaned comments.
+        :param expanded_keywords: Dictionary of expanded keywords and their similarity scores.
+        :param review_ids: Review ids of the comments, to reuse cached embeddings.
+        :return: Dictionary mapping each initial keyword to its keyword-comment similarities.
+        """
+        embeddings = self.embed_comments(comments, review_ids)
+        return {
+            kw: get_comment_similarity(
+                kw, expanded_keywords, embeddings, embedder=self.embedder
+            )
+            for kw in self.initial_keywords
+        }
+
+    def cascade_similarities(self, comments, expanded_keywords):
+        """
+        Two-stage scoring: static embeddings pick candidate comments, which alone get
+        BioBERT embeddings; the other comments get calibrated first-stage similarities.
+        :param comments: List of cleaned comments.
+        :param expanded_keywords: Dictionary of expanded keywords and their similarity scores.
+        :return: Dictionary mapping each initial keyword to its keyword-comment similarities.
+        """
+        static = self.static_similarities(comments, expanded_keywords)
+        if self.cascade_fraction is None:
+            # Calibrate on this drug: score it exactly and measure cascade recall
+            exact = self.exact_similarities(comments, expanded_keywords)
+            self.cascade_fraction, report = tune_cascade_fraction(
+                static, exact, expanded_keywords, len(comments), self.cascade_recall
+            )
+            log_progress(f"Cascade top-k recall by fraction: {report}")
+            log_progress(f"Using cascade fraction {self.cascade_fraction}")
+            return exact
+
+        candidates = cascade_candidates(
+            static, expanded_keywords, self.cascade_fraction, len(comments)
+        )
+        return self.candidate_similarities(
+            comments, expanded_keywords, static, candidates
+        )
+
+    def hybrid_similarities(self, drug_view, comments, expanded_keywords):
+        """
+        Hybrid scoring: comments with a BM25 hit for any expanded keyword, plus the
+        best comments by static similarity, get BioBERT embeddings; the other
+        comments get calibrated first-stage similarities.
+        :param drug_view: DrugView of the drug, whose rows index the lexical index.
+        :param comments: List of cleaned comments.
+        :param expanded_keywords: Dictionary of expanded keywords and their similarity scores.
+        :return: Dictionary mapping each initial keyword to its keyword-comment similarities.
+        """
+        static = self.static_similarities(comments, expanded_keywords)
+        lexical = {
+            kw: get_lexical_scores(
+                self.lexical_index,
+                kw,
+                expanded_keywords,
+                drug_view.start,
+                drug_view.stop,
+            )
+            for kw in self.initial_keywords
+        }
+        candidates = hybrid_candidates(
+            lexical, static, expanded_keywords, self.hybrid_budget, len(comments)
+        )
+        return self.candidate_similarities(
+            comments, expanded_keywords, static, candidates
+        )
+
+    def static_similarities(self, comments, expanded_keywords):
+        """
+        First-stage similarities computed on static token embeddings.
+        :return: Dictionary mapping each initial keyword to its static similarities.
+        """
+        static_embeddings = self.embedder.get_static_embeddings(comments)
+        return {
+            kw: get_static_similarity(
+                kw, expanded_keywords, static_embeddings, embedder=self.embedder
+            )
+            for kw in self.initial_keywords
+        }
+
+    def candidate_similarities(self, comments, expanded_keywords, static, candidates):
+        """
+        Embed only the candidate comments with BioBERT and fill in the others from
+        their static similarities.
+        :return: Dictionary mapping each initial keyword to its keyword-comment similarities.
+        """
+        embeddings = self.embedder.embed_batch([comments[idx] for idx in candidates])
+        self.n_forward_passes += len(candidates)
+        log_progress(f"Embedding {len(candidates)} of {len(comments)} comments")
+        return {
+            kw: fill_similarity(
+                get_comment_similarity(
+                    kw, expanded_keywords, embeddings, embedder=self.embedder
+                ),
+                static[kw],
+                candidates,
+                len(comments),
+            )
+            for kw in self.initial_keywords
+        }
+
+    def embed_to_memmap(self, comments, file_path, tile_rows=1024):
+        """
+        Embed comments with BioBERT, writing them tile by tile to a memory-mapped
+        .npy file instead of keeping them in memory.
+        :param comments: List of cleaned comments.
+        :param file_path: Path of the .npy file.
+        :param tile_rows: Number of comments embedded before each write.
+        :return: Read-only np.memmap of shape (len(comments), hidden_size).
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+        dim = self.embedder.model.config.hidden_size
+        embeddings = np.lib.format.open_memmap(
+            file_path, mode="w+", dtype=np.float32, shape=(len(comments), dim)
+        )
+        for start in range(0, len(comments), tile_rows):
+            tile = comments[start : start + tile_rows]
+            embeddings[start : start + len(tile)] = self.embedder.embed_batch(tile)
+        embeddings.flush()
+        del embeddings
+        self.n_forward_passes += len(comments)
+        return np.load(file_path, mmap_mode="r")
+
+    def out_of_core_scores(self, drug, drug_view, comments, expanded_keywords):
+        """
+        Score one drug from memory-mapped embeddings in fixed-size tiles.
+        :return: Side effect scores and top comments of the drug.
+        """
+        embeddings = self.embed_to_memmap(
+            comments, os.path.join(self.embedding_dir, f"{safe_filename(drug)}.npy")
+        )
+        log_progress(f"Scoring {len(comments)} comments for {drug} out of core")
+        side_effect_score, top, _ = out_of_core_side_effects(
+            embeddings,
+            self.initial_keywords,
+            expanded_keywords,
+            memory_budget_mb=self.memory_budget_mb,
+            top_k=self.top_k,
+            assign_fn=drug_view.add_side_effect,
+            embedder=self.embedder,
+        )
+        top_k_comments = [
+            {
+                "drug": drug_view.drug_names[idx],
+                "side_effect": kw,
+                "comment": drug_view.review_text[idx],
+                "score": score,
+            }
+            for kw in self.initial_keywords
+            for idx, score in top[kw]
+        ]
+        return side_effect_score, top_k_comments
+
+    def train_pq(self, comment_store, data_version=None, seed=0):
+        """
+        Load the PQ codec of the current model and data from the embedding
+        directory, or train it on a random sample of the corpus and save it there.
+        The codec and the drugs' codes live in a directory keyed by the data
+        version, so codes computed from older data are never reused.
+        :param comment_store: CommentStore of all comments being analyzed.
+        :param data_version: Digest of the reviews, from data_version.
+        :param seed: Random seed of the training sample.
+        """
+        name = f"pq_{self.model_name.replace('/', '_')}_{self.pq_subspaces}"
+        if data_version is not None:
+            name += f"_{data_version[:16]}"
+        self.pq_dir = os.path.join(self.embedding_dir, name)
+        self.pq_data_version = data_version
+        path = os.path.join(self.pq_dir, "codec.npz")
+        if os.path.exists(path):
+            self.pq_codec = ProductQuantizer.load(path)
+            return
+        rng = np.random.default_rng(seed)
+        n_train = min(self.pq_train_size, len(comment_store))
+        rows = np.sort(rng.choice(len(comment_store), n_train, replace=False))
+        log_progress(f"Training PQ codec on {n_train} comments...")
+        review_ids = comment_store.columns.get("review_id")
+        embeddings = self.embed_comments(
+            list(comment_store.cleaned_comments[rows]),
+            None if review_ids is None else list(review_ids[rows]),
+        )
+        # uint8 codes allow up to 256 centroids; a small corpus gets one per comment
+        self.pq_codec = ProductQuantizer(
+            self.pq_subspaces, n_centroids=min(256, n_train)
+        ).fit(np.asarray(embeddings))
+        os.makedirs(self.pq_dir, exist_ok=True)
+        self.pq_codec.save(path)
+
+    def pq_codes(self, drug, comments, tile_rows=1024):
+        """
+        PQ codes of one drug's comments, loaded from the codec's directory or
+        computed tile by tile and saved there. No float embeddings are kept.
+        :param drug: Drug name.
+        :param comments: List of cleaned comments.
+        :param tile_rows: Number of comments embedded and encoded at once.
+        :return: uint8 array of shape (len(comments), pq_subspaces).
+        """
+        path = os.path.join(self.pq_dir, f"{safe_filename(drug)}.npy")
+        if os.path.exists(path):
+            codes = np.load(path)
+            if len(codes) == len(comments):
+                log_progress(f"Loaded PQ codes for {drug}")
+                return codes
+        codes = np.empty((len(comments), self.pq_subspaces), dtype=np.uint8)
+        for start in range(0, len(comments), tile_rows):
+            tile = comments[start : start + tile_rows]
+            codes[start : start + len(tile)] = self.pq_codec.encode(
+                self.embedder.embed_batch(tile)
+            )
+        self.n_forward_passes += len(comments)
+        atomic_write(path, lambda f: np.save(f, codes), mode="wb")
+        return codes
+
+    def pq_similarities(self, drug, comments, expanded_keywords):
+        """
+        Score keywords against one drug's PQ codes with lookup tables.
+        :return: Tuple (dictionary mapping each initial keyword to its approximate
+                 keyword-comment similarities, dictionary mapping each initial
+                 keyword to a callable giving exact comment scores for indices).
+        """
+        onehot = self.pq_codec.onehot(self.pq_codes(drug, comments))
+        kw_embeddings = {}
+        for kw in self.initial_keywords:
+            exp_kw = [list(item.keys())[0] for item in expanded_keywords[kw]]
+            if exp_kw:
+                kw_embeddings[kw] = np.vstack(
+                    [self.embedder.get_embeddings(word)[0] for word in exp_kw]
+                )
+        if self.pq_report and kw_embeddings:
+            path = os.path.join(self.embedding_dir, f"{safe_filename(drug)}.npy")
+            embeddings = self.embed_to_memmap(comments, path)
+            for kw, queries in kw_embeddings.items():
+                report = pq_report(self.pq_codec, embeddings, queries)
+                log_progress(f"PQ report for {drug}, {kw}: {report}")
+            del embeddings
+            os.remove(path)
+
+        # Exact embeddings of the rerank candidates, shared across side effects
+        exact = {}
+
+        def exact_embeddings(idx):
+            missing = [i for i in idx if i not in exact]
+            if missing:
+                embedded = self.embedder.embed_batch([comments[i] for i in missing])
+                self.n_forward_passes += len(missing)
+                exact.update(zip(missing, normalize(embedded)))
+            return np.vstack([exact[i] for i in idx])
+
+        similarities, rerank_fns = {}, {}
+        for kw in self.initial_keywords:
+            if kw not in kw_embeddings:
+                similarities[kw] = {}
+                rerank_fns[kw] = lambda idx: np.zeros(len(idx))
+                continue
+            exp_kw = [list(item.keys())[0] for item in expanded_keywords[kw]]
+            scores = self.pq_codec.similarities(onehot, kw_embeddings[kw])
+            similarities[kw] = dict(zip(exp_kw, scores.T))
+
+            def rerank_fn(idx, kw=kw, exp_kw=exp_kw, queries=kw_embeddings[kw]):
+                similarity = exact_embeddings(idx) @ normalize(queries).T
+                return weighted_comment_scores(
+                    dict(zip(exp_kw, similarity.T)), kw, expanded_keywords, len(idx)
+                )
+
+            rerank_fns[kw] = rerank_fn
+        return similarities, rerank_fns
+
+    def sampled_scores(self, drug_view, comments, expanded_keywords):
+        """
+        Score one drug from an adaptively grown stratified sample of its comments.
+        Comments are stratified by length quartile and, when the data has a
+        'source' column, by source. Side effects are assigned to sampled comments
+        above the sample median, and top comments are taken from the sample.
+        :return: Side effect scores, their confidence intervals and top comments.
+        """
+        kw_embeddings, weights = keyword_weight_matrix(
+            self.initial_keywords, expanded_keywords, self.embedder
+        )
+        review_ids = (
+            drug_view.column("review_id") if self.review_db is not None else None
+        )
+
+        def score_fn(idx):
+            embeddings = self.embed_comments(
+                [comments[i] for i in idx],
+                None if review_ids is None else [review_ids[i] for i in idx],
+            )
+            if not len(idx):
+                return np.empty((0, len(self.initial_keywords)))
+            _, scores = next(
+                iter_tile_scores(
+                    np.asarray(embeddings), kw_embeddings, weights, len(idx)
+                )
+            )
+            return scores
+
+        sources = (
+            drug_view.column("source") if "source" in drug_view.store.columns else None
+        )
+        strata = stratify([len(c.split()) for c in comments], sources)
+        side_effect_score, intervals, sample, values = sampled_side_effects(
+            score_fn,
+            strata,
+            self.initial_keywords,
+            k=self.stable_k,
+            confidence=self.confidence,
+            initial_size=self.sample_size,
+        )
+        log_progress(f"Sampled {len(sample)} of {len(comments)} comments")
 
-        new_comment_dict = []
-        side_effect_scores = {}
         top_k_comments = []
+        for col, kw in enumerate(self.initial_keywords):
+            scores = values[:, col]
+            above = np.flatnonzero(scores >= np.percentile(scores, 50))
+            drug_view.add_side_effect(np.sort(sample[above]), kw)
+            top = above[np.lexsort((sample[above], -scores[above]))[: self.top_k]]
+            top_k_comments.extend(
+                {
+                    "drug": drug_view.drug_names[sample[i]],
+                    "side_effect": kw,
+                    "comment": drug_view.review_text[sample[i]],
+                    "score": scores[i],
+                }
+                for i in top
+            )
+        return side_effect_score, intervals, top_k_comments
 
-        log_progress("Begin iterate over drugs...")
-        for drug in drugs:
-            log_progress(f"Processing drug: {drug}")
-            # Filter comments for the specific drug
-            drug_dict, comments = pick_drug(comment_dict, drug)
-            log_progress("Embedding comments...")
-            # Generate embeddings for comments
-            embeddings = [
-                self.embedder.get_embeddings(comment)[0] for comment in comments
-            ]
+    def score_drug(self, drug, drug_view, comments):
+        """
+        Score one drug against self.initial_keywords with the selected mode and
+        record the matched comments of each side effect in drug_view.
+        :return: Tuple (side effect scores, their confidence intervals or None,
+                 top comments).
+        """
+        # Expand keywords
+        expanded_keywords = self.keyword_expander.expand_keywords(self.initial_keywords)
 
-            # Expand keywords
-            expanded_keywords = self.keyword_expander.expand_keywords(
-                self.initial_keywords
+        log_progress("Embedding comments...")
+        intervals = None
+        if self.approximate:
+            side_effect_score, intervals, drug_top_k_comments = self.sampled_scores(
+                drug_view, comments, expanded_keywords
             )
+        elif self.out_of_core:
+            side_effect_score, drug_top_k_comments = self.out_of_core_scores(
+                drug, drug_view, comments, expanded_keywords
+            )
+        else:
+            # Calculate similarity between keywords and comments
+            rerank_fns = {}
+            if self.pq:
+                similarities, rerank_fns = self.pq_similarities(
+                    drug, comments, expanded_keywords
+                )
+            elif self.cascade:
+                similarities = self.cascade_similarities(comments, expanded_keywords)
+            elif self.hybrid:
+                similarities = self.hybrid_similarities(
+                    drug_view, comments, expanded_keywords
+                )
+            else:
+                review_ids = (
+                    drug_view.column("review_id")
+                    if self.review_db is not None
+                    else None
+                )
+                similarities = self.exact_similarities(
+                    comments, expanded_keywords, review_ids
+                )
 
             # Analyze side effects
             side_effect_score = {}
+            drug_top_k_comments = []
             for kw in self.initial_keywords:
-                # Calculate similarity between keywords and comments
                 log_progress(f"Processing {kw} for {drug}")
-                kw_comment_similarities = get_comment_similarity(
-                    kw, expanded_keywords, embeddings
-                )
+                kw_comment_similarities = similarities[kw]
                 # Evaluate overall score for the keyword
                 score = evaluate_score(kw_comment_similarities, kw, expanded_keywords)
                 side_effect_score[kw] = score
 
                 # Match comments with side effects and rank
-                drug_dict, top_k_comment = comment_side_effect(
-                    kw_comment_similarities, kw, expanded_keywords, drug_dict
+                drug_view, top_k_comment = comment_side_effect(
+                    kw_comment_similarities,
+                    kw,
+                    expanded_keywords,
+                    drug_view,
+                    top_k=self.top_k,
+                    rerank_fn=rerank_fns.get(kw),
+                    rerank_depth=self.pq_rerank_depth,
+                )
+                drug_top_k_comments.extend(top_k_comment)
+        return side_effect_score, intervals, drug_top_k_comments
+
+    def data_version(self, file_path):
+        """
+        Digest of the reviews in a CSV file or review database. A review
+        database also caches embeddings and scores, so it is versioned by the
+        digest of its reviews rather than of the file. With a result cache the
+        version is also registered there, dropping results of older data.
+        :param file_path: Path to the CSV file or SQLite review database.
+        :return: Hex digest string.
+        """
+        digest = None
+        if is_review_db(file_path):
+            digest = ReviewDatabase(file_path).data_version()
+        if self.result_cache is not None:
+            return self.result_cache.data_version(file_path, digest)
+        if digest is None:
+            stat = os.stat(file_path)
+            key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+            if key not in self.data_versions:
+                self.data_versions[key] = file_digest(file_path)
+            digest = self.data_versions[key]
+        return digest
+
+    def run_signature(self, data_version):
+        """
+        Settings that determine a drug's results besides the side effects: data
+        version, model, keyword expansion, top-k and the scoring mode with its
+        parameters. Checkpoints written with another signature are not resumed.
+        :param data_version: Digest of the reviews.
+        :return: JSON-serializable dictionary.
+        """
+        expander = self.keyword_expander
+        official = json.dumps(list(expander.side_effects_official))
+        signature = {
+            "data": data_version,
+            "model": self.model_name,
+            "expansion": [
+                hashlib.sha256(official.encode("utf-8")).hexdigest(),
+                expander.threshold,
+                expander.top_k,
+            ],
+            "top_k": self.top_k,
+            "mode": "exact",
+            "params": [],
+        }
+        if self.cascade:
+            signature["mode"] = "cascade"
+            signature["params"] = [
+                self.configured_cascade_fraction,
+                self.cascade_recall,
+            ]
+        elif self.out_of_core:
+            signature["mode"] = "out_of_core"
+            signature["params"] = [self.memory_budget_mb]
+        elif self.hybrid:
+            signature["mode"] = "hybrid"
+            signature["params"] = [self.hybrid_budget]
+        elif self.approximate:
+            signature["mode"] = "approximate"
+            signature["params"] = [self.confidence, self.sample_size, self.stable_k]
+        elif self.pq:
+            signature["mode"] = "pq"
+            signature["params"] = [
+                self.pq_subspaces,
+                self.pq_rerank_depth,
+                self.pq_train_size,
+            ]
+        return signature
+
+    def cache_context(self, data_version, drugs):
+        """
+        Key parts shared by the cached results of a run: data version, model,
+        keyword expansion and top-k settings, and the scoring mode with its
+        parameters. Exact and PQ scores of a (drug, side effect) pair do not
+        depend on the rest of the query; the other modes select, tile or sample
+        comments jointly over all side effects, so the side effect set (and for
+        hybrid's BM25 statistics, the drug set) is part of their key.
+        :param data_version: Digest of the reviews.
+        :param drugs: List of drugs of the query.
+        :return: Dictionary of key parts.
+        """
+        context = self.run_signature(data_version)
+        if self.pq:
+            context["codec"] = hashlib.sha256(
+                self.pq_codec.codebooks.tobytes()
+            ).hexdigest()
+            return context
+        if self.cascade:
+            context["cascade_fraction"] = self.cascade_fraction
+        elif self.hybrid:
+            context["drugs"] = sorted(drugs)
+        elif not (self.out_of_core or self.approximate):
+            return context
+        context["side_effects"] = sorted(self.initial_keywords)
+        return context
+
+    def cached_score_drug(self, drug, drug_view, comments, data_version, drugs):
+        """
+        score_drug through the result cache: only the side effects whose
+        (drug, side effect) result is not cached are scored, and they are then
+        cached with their matched comments. In the joint modes a result depends
+        on the whole side effect set, so any miss rescores the full set.
+        :param data_version: Digest of the reviews.
+        :param drugs: List of drugs of the query.
+        :return: Same as score_drug, in the order of self.initial_keywords.
+        """
+        keywords = self.initial_keywords
+        context = self.cache_context(data_version, drugs)
+        keys = {
+            kw: ResultCache.key(drug=drug, side_effect=kw, **context) for kw in keywords
+        }
+        entries = {}
+        for kw in keywords:
+            entry = self.result_cache.get(keys[kw])
+            if entry is not None:
+                entries[kw] = entry
+        missing = [kw for kw in keywords if kw not in entries]
+        if missing and "side_effects" in context:
+            # Scoring only the missing subset would store results of another set
+            # under keys of the full set
+            entries, missing = {}, list(keywords)
+        log_progress(
+            f"Result cache for {drug}: {len(entries)} hits, {len(missing)} misses"
+        )
+
+        for kw, entry in entries.items():
+            drug_view.add_side_effect(np.asarray(entry["matched"], dtype=np.int64), kw)
+        if missing:
+            self.initial_keywords = missing
+            try:
+                scores, intervals, top_k_comments = self.score_drug(
+                    drug, drug_view, comments
                 )
-                top_k_comments.extend(top_k_comment)
+            finally:
+                self.initial_keywords = keywords
+            for kw in missing:
+                entries[kw] = {
+                    "score": scores[kw],
+                    "interval": None if intervals is None else intervals[kw],
+                    "top_k_comments": [
+                        row for row in top_k_comments if row["side_effect"] == kw
+                    ],
+                    "matched": drug_view.side_effect_idx(kw),
+                }
+                self.result_cache.put(keys[kw], entries[kw], data_version)
+        self.result_cache.save()
+
+        side_effect_score = {kw: entries[kw]["score"] for kw in keywords}
+        intervals = None
+        if self.approximate:
+            intervals = {kw: tuple(entries[kw]["interval"]) for kw in keywords}
+        top_k_comments = [
+            row for kw in keywords for row in entries[kw]["top_k_comments"]
+        ]
+        return side_effect_score, intervals, top_k_comments
+
+    @staticmethod
+    def checkpoint_path(run_dir, drug):
+        """
+        Path of the checkpoint file holding one drug's results. The file name is
+        derived with safe_filename; the drug name itself is stored in the file.
+        :param run_dir: Directory of the current run.
+        :param drug: Drug name.
+        :return: Path to the drug's checkpoint file.
+        """
+        return os.path.join(run_dir, "drugs", f"{safe_filename(drug)}.json")
+
+    def save_checkpoint(
+        self,
+        run_dir,
+        drug,
+        signature,
+        drug_dict,
+        side_effect_score,
+        top_k,
+        intervals=None,
+    ):
+        """
+        Atomically write the results of one finished drug to the run directory.
+        :param signature: run_signature of the settings the results come from.
+        """
+        atomic_write_json(
+            {
+                "drug": drug,
+                "side_effects": list(self.initial_keywords),
+                "signature": signature,
+                "comments": drug_dict,
+                "scores": side_effect_score,
+                "top_k_comments": top_k,
+                "intervals": intervals,
+            },
+            self.checkpoint_path(run_dir, drug),
+        )
+
+    def load_checkpoint(self, run_dir, drug, signature):
+        """
+        Load a finished drug from the run directory.
+        :param signature: run_signature of the current settings.
+        :return: The checkpoint dictionary, or None if the drug has no checkpoint
+                 for the current side effects, data, model, top-k and mode.
+        """
+        checkpoint = load_json(self.checkpoint_path(run_dir, drug))
+        if (
+            checkpoint is None
+            or checkpoint["drug"] != drug
+            or checkpoint["side_effects"] != list(self.initial_keywords)
+            or checkpoint.get("signature") != signature
+        ):
+            return None
+        return checkpoint
 
-            new_comment_dict.extend(drug_dict)
-            side_effect_scores[drug] = side_effect_score
+    def prepare_store(self, file_path, drugs):
+        """
+        Load and preprocess the reviews of the selected drugs into a comment
+        store, and build the mode's corpus-wide structures (PQ codec, lexical
+        index) over it.
+        :param file_path: Path to the CSV file or SQLite review database.
+        :param drugs: List of drugs to load.
+        :return: CommentStore.
+        """
+        data = load_reviews(file_path, drugs)
+        self.review_db = ReviewDatabase(file_path) if is_review_db(file_path) else None
 
+        # Prepare drug-indexed comment store
+        comment_store = prepare_comment_store(data, "cleaned_comments")
+        if self.pq:
+            data_version = self.data_version(file_path)
+            if self.pq_codec is None or self.pq_data_version != data_version:
+                self.train_pq(comment_store, data_version)
+        if self.hybrid:
+            log_progress("Building lexical index...")
+            self.lexical_index = InvertedIndex(
+                comment_store.cleaned_comments,
+                comment_store.columns[comment_store.drug_col],
+            )
+        return comment_store
+
+    def iter_results(
+        self,
+        file_path,
+        drugs,
+        initial_keywords,
+        run_dir=None,
+        resume=False,
+        comment_store=None,
+    ):
+        """
+        Processes drug reviews, yielding each drug's results as soon as it is done.
+        :param file_path: Path to the CSV file or SQLite review database. With a
+                          database only the selected drugs are read, embeddings are
+                          cached and scores are stored in it.
+        :param drugs: List of drugs to analyze.
+        :param initial_keywords: List of side effects to score.
+        :param run_dir: Directory where each drug's results are checkpointed as soon
+                        as the drug is finished. No checkpoints are written if None.
+        :param resume: Skip drugs already checkpointed in run_dir for the same side
+                       effects and run signature (data, model, top-k and mode)
+                       and yield their checkpointed results.
+        :param comment_store: CommentStore from prepare_store holding at least the
+                              selected drugs, reused across calls. If None, one is
+                              built for the selected drugs.
+        :return: Generator of DrugResult, one per drug.
+        """
+        self.initial_keywords = initial_keywords
+        if comment_store is None:
+            comment_store = self.prepare_store(file_path, drugs)
+        data_version = self.data_version(file_path)
+        signature = self.run_signature(data_version)
+
+        log_progress("Begin iterate over drugs...")
+        for drug in drugs:
+            if resume and run_dir is not None:
+                checkpoint = self.load_checkpoint(run_dir, drug, signature)
+                if checkpoint is not None:
+                    log_progress(f"Loaded checkpoint for drug: {drug}")
+                    yield DrugResult(
+                        drug,
+                        checkpoint["comments"],
+                        checkpoint["scores"],
+                        checkpoint["top_k_comments"],
+                        checkpoint.get("intervals"),
+                    )
+                    continue
+
+            log_progress(f"Processing drug: {drug}")
+            # Filter comments for the specific drug (a view into the store)
+            drug_view, comments = pick_drug(comment_store, drug)
+
+            self.n_comments += len(comments)
+            if self.result_cache is None:
+                side_effect_score, intervals, drug_top_k_comments = self.score_drug(
+                    drug, drug_view, comments
+                )
+            else:
+                side_effect_score, intervals, drug_top_k_comments = (
+                    self.cached_score_drug(
+                        drug, drug_view, comments, data_version, drugs
+                    )
+                )
+
+            # Materialize the drug's annotated rows for export, then free the
+            # drug's assignments
+            drug_dict = drug_view.to_records()
+            drug_view.clear_side_effects()
+            if self.review_db is not None:
+                self.review_db.save_scores(drug, side_effect_score, self.model_name)
+            if run_dir is not None:
+                self.save_checkpoint(
+                    run_dir,
+                    drug,
+                    signature,
+                    drug_dict,
+                    side_effect_score,
+                    drug_top_k_comments,
+                    intervals,
+                )
             log_progress(f"Side effect scores for {drug}: {side_effect_score}\n")
-        print(new_comment_dict)
+            yield DrugResult(
+                drug, drug_dict, side_effect_score, drug_top_k_comments, intervals
+            )
+
+        if self.n_comments:
+            log_progress(
+                f"BioBERT forward passes: {self.n_forward_passes} for "
+                f"{self.n_comments} comments "
+                f"({1 - self.n_forward_passes / self.n_comments:.1%} avoided)"
+            )
+        if self.result_cache is not None:
+            log_progress(self.result_cache.stats())
+
+    def process_file(
+        self, file_path, drugs, initial_keywords, run_dir=None, resume=False
+    ):
+        """
+        Processes a CSV file containing drug reviews.
+        Takes the same arguments as iter_results and collects all drugs' results.
+        :return: Updated comment dictionary, side effect scores, and top comments.
+        """
+        new_comment_dict = []
+        side_effect_scores = {}
+        top_k_comments = []
+        for result in self.iter_results(
+            file_path, drugs, initial_keywords, run_dir=run_dir, resume=resume
+        ):
+            new_comment_dict.extend(result.comments)
+            side_effect_scores[result.drug] = result.scores
+            top_k_comments.extend(result.top_k_comments)
         return new_comment_dict, side_effect_scores, top_k_comments
 
 
-def prepare_data(file_path):
+def prepare_data(file_path, near_dup_threshold=0.8, db_path=None):
     # Preprocess and save cleaned reviews for simulants
     log_progress("Processing and cleaning simulants reviews...")
     simulants_data = pd.read_csv("data/simulants_reviews.csv")
@@ -130,7 +973,7 @@ def prepare_data(file_path):
     # Clean reviews using prepare_comment_dict
     simulants_comment_dict = prepare_comment_dict(simulants_data, "Review Text")
     # Save cleaned reviews
-    cleaned_simulants = pd.DataFrame(simulants_comment_dict)
+    cleaned_simulants = pd.DataFrame(simulants_comment_dict).assign(source="simulants")
 
     # Repeat the process for non-simulants
     log_progress("Processing and cleaning non-simulants reviews...")
@@ -142,11 +985,13 @@ def prepare_data(file_path):
     # Clean reviews using prepare_comment_dict
     non_simulants_comment_dict = prepare_comment_dict(non_simulants_data, "Review Text")
     # Save cleaned reviews
-    cleaned_non_simulants = pd.DataFrame(non_simulants_comment_dict)
+    cleaned_non_simulants = pd.DataFrame(non_simulants_comment_dict).assign(
+        source="non_simulants"
+    )
 
     # Process reddit reviews
     log_progress("Processing and cleaning reddit reviews...")
-    reddit_df = get_merged_data("data/cleaned_reddit")
+    reddit_df = get_merged_data("data/cleaned_reddit").assign(source="reddit")
 
     # Combine dataset
     data = pd.concat([cleaned_simulants, cleaned_non_simulants, reddit_df])
@@ -158,11 +1003,21 @@ def prepare_data(file_path):
     ]
     data = filtered_data.drop_duplicates(subset=["Drug Name", "Review Text"])
     data = data.dropna()
+
+    # Remove near-duplicate comments (reposts, quoted replies, cross-posts)
+    n_comments = len(data)
+    data = get_deduplicated_comment(data, threshold=near_dup_threshold)
+    log_progress(f"Removed {n_comments - len(data)} near-duplicate comments")
     data = data.drop(columns=["index"])
 
     # Save dataset to file
     data.to_csv(file_path, index=False)
 
+    # Build the indexed SQLite review store if requested
+    if db_path is not None:
+        log_progress(f"Building review database {db_path}...")
+        ReviewDatabase(db_path).build(data)
+
 
 def parse_choices(value):
     list = value.split(",")
@@ -179,14 +1034,196 @@ if __name__ == "__main__":
         "-se", "--side_effect", type=parse_choices, help="Input a side_effect"
     )
     parser.add_argument("--process_data", action="store_true")
+    parser.add_argument(
+        "--near_dup_threshold",
+        type=float,
+        default=0.8,
+        help="Jaccard threshold for near-duplicate comment removal",
+    )
+    parser.add_argument(
+        "--run_dir",
+        default="output/run",
+        help="Directory where per-drug results are checkpointed",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Skip drugs already checkpointed in --run_dir",
+    )
+    parser.add_argument(
+        "--cascade",
+        action="store_true",
+        help="Prefilter comments with static embeddings before BioBERT",
+    )
+    parser.add_argument(
+        "--cascade_fraction",
+        type=float,
+        help="Fraction of comments per side effect embedded in cascade mode",
+    )
+    parser.add_argument(
+        "--cascade_recall",
+        type=float,
+        default=0.95,
+        help="Target top-k recall used to tune --cascade_fraction",
+    )
+    parser.add_argument(
+        "--out_of_core",
+        action="store_true",
+        help="Score memory-mapped embeddings in tiles with a memory budget",
+    )
+    parser.add_argument(
+        "--memory_budget_mb",
+        type=int,
+        default=512,
+        help="Memory budget per scoring tile in --out_of_core mode",
+    )
+    parser.add_argument(
+        "--hybrid",
+        action="store_true",
+        help="Embed only comments with a BM25 keyword hit plus a static budget",
+    )
+    parser.add_argument(
+        "--hybrid_budget",
+        type=float,
+        default=0.05,
+        help="Fraction of comments per side effect added by static similarity",
+    )
+    parser.add_argument(
+        "--approximate",
+        action="store_true",
+        help="Estimate scores from an adaptive stratified sample of comments",
+    )
+    parser.add_argument(
+        "--confidence",
+        type=float,
+        default=0.95,
+        help="Confidence level of the intervals in --approximate mode",
+    )
+    parser.add_argument(
+        "--sample_size",
+        type=int,
+        default=200,
+        help="Initial sample size per drug in --approximate mode",
+    )
+    parser.add_argument(
+        "--pq",
+        action="store_true",
+        help="Score keywords from product-quantized comment embeddings",
+    )
+    parser.add_argument(
+        "--pq_subspaces",
+        type=int,
+        default=48,
+        help="Bytes per product-quantization code in --pq mode",
+    )
+    parser.add_argument(
+        "--pq_report",
+        action="store_true",
+        help="Log PQ compression, speedup and ranking agreement per drug",
+    )
+    parser.add_argument(
+        "--autotune",
+        action="store_true",
+        help="Benchmark threads and batch sizes on a corpus sample, save the "
+        "profile of this host and model, and exit",
+    )
+    parser.add_argument(
+        "--threads", type=int, help="Torch intra-op threads (overrides the profile)"
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        help="Comments per forward pass (overrides the profile)",
+    )
+    parser.add_argument(
+        "--max_tokens",
+        type=int,
+        help="Padded tokens per forward pass (overrides the profile)",
+    )
+    parser.add_argument(
+        "--model",
+        default="dmis-lab/biobert-base-cased-v1.2",
+        help="Model name or local directory (e.g. from --export_safetensors)",
+    )
+    parser.add_argument(
+        "--export_safetensors",
+        help="Save the model as safetensors weights to this directory and exit",
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        help="Number of local worker processes sharing the model weights",
+    )
+    parser.add_argument(
+        "--threads_per_worker",
+        type=int,
+        help="Torch threads per worker process in --shards/--worker mode",
+    )
+    parser.add_argument(
+        "--worker",
+        action="store_true",
+        help="Join the work queue of the sharded run in --run_dir and exit",
+    )
+    parser.add_argument(
+        "--sqlite",
+        help="SQLite review database; built by --process_data and read by analysis",
+    )
+    parser.add_argument(
+        "--output_format",
+        choices=["csv", "json", "parquet"],
+        default="csv",
+        help="Format of the incrementally written result tables",
+    )
+    parser.add_argument(
+        "--dry_run",
+        "--dry-run",
+        action="store_true",
+        help="Print the predicted per-drug cost of the run and exit",
+    )
+    parser.add_argument(
+        "--top_k",
+        type=int,
+        default=10,
+        help="Number of top comments kept per drug and side effect",
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="Reuse (drug, side effect) results cached by earlier runs",
+    )
+    parser.add_argument(
+        "--cache_dir",
+        default="output/cache",
+        help="Directory of the --cache result cache",
+    )
+    parser.add_argument(
+        "--cache_size_mb",
+        type=int,
+        default=512,
+        help="Size of the --cache result cache before LRU eviction",
+    )
+    parser.add_argument(
+        "--cooccurrence",
+        action="store_true",
+        help="Export side effect co-occurrence and drug similarity matrices",
+    )
+    parser.add_argument(
+        "--cooccurrence_min_count",
+        type=int,
+        default=5,
+        help="Minimum number of comments of an exported co-occurring pair",
+    )
     args = parser.parse_args()
+    if args.cooccurrence and args.approximate:
+        # Only sampled comments are assigned side effects in approximate mode
+        parser.error("--cooccurrence cannot be combined with --approximate")
 
     file_path = "data/reviews.csv"
 
     # If user called process_data, apply prepare_data function to build precessed dataset and save to certain path. Terminate  running.
     if args.process_data:
         log_progress("Preparing data ...")
-        prepare_data(file_path)
+        prepare_data(file_path, args.near_dup_threshold, args.sqlite)
         sys.exit()
 
     # Step 1: Setup official side effects
@@ -197,9 +1234,16 @@ if __name__ == "__main__":
 
     # Step 2: Deal with user's request if needed. If no argument parsed, use default value
     # By default, initial_keywords will be set to the official side effect, drugs will set to all drugs in our dataset
-    data = pd.read_csv(file_path)
-    comment_dict = prepare_comment_dict(data, "cleaned_comments")
-    drugs = get_drugs(data)
+    if args.sqlite:
+        # Only the drug index is read here; process_file loads the selected drugs
+        file_path = args.sqlite
+        review_db = ReviewDatabase(file_path)
+        drugs = review_db.drugs()
+        comment_counts = review_db.drug_counts()
+    else:
+        data = pd.read_csv(file_path)
+        drugs = get_drugs(data)
+        comment_counts = data["Drug Name"].value_counts()
     if args.drug:
         assert all(
             drug in drugs for drug in args.drug
@@ -212,30 +1256,119 @@ if __name__ == "__main__":
         initial_keywords = args.side_effect
 
     # Step 3: Initialize the SideEffectAnalyzer
-    analyzer = SideEffectAnalyzer(initial_keywords, side_effects_official)
+    analyzer = SideEffectAnalyzer(
+        initial_keywords,
+        side_effects_official,
+        model_name=args.model,
+        cascade=args.cascade,
+        cascade_fraction=args.cascade_fraction,
+        cascade_recall=args.cascade_recall,
+        out_of_core=args.out_of_core,
+        memory_budget_mb=args.memory_budget_mb,
+        hybrid=args.hybrid,
+        hybrid_budget=args.hybrid_budget,
+        approximate=args.approximate,
+        confidence=args.confidence,
+        sample_size=args.sample_size,
+        pq=args.pq,
+        pq_subspaces=args.pq_subspaces,
+        pq_report=args.pq_report,
+        top_k=args.top_k,
+        result_cache=(
+            ResultCache(args.cache_dir, args.cache_size_mb) if args.cache else None
+        ),
+    )
+    if args.autotune:
+        store = prepare_comment_store(
+            load_reviews(file_path, drugs), "cleaned_comments"
+        )
+        rows = np.random.default_rng(0).choice(
+            len(store), min(256, len(store)), replace=False
+        )
+        log_progress(f"Autotuning on {len(rows)} comments...")
+        profile = autotune(analyzer.embedder, list(store.cleaned_comments[rows]))
+        log_progress(
+            f"Best settings: threads={profile['threads']}, "
+            f"batch_size={profile['batch_size']}, max_tokens={profile['max_tokens']} "
+            f"({profile['comments_per_second']:.1f} comments/s)"
+        )
+        sys.exit()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    if args.batch_size:
+        analyzer.embedder.batch_size = args.batch_size
+    if args.max_tokens:
+        analyzer.embedder.max_tokens = args.max_tokens
+    if args.export_safetensors:
+        analyzer.embedder.save_safetensors(args.export_safetensors)
+        log_progress(f"Saved safetensors weights to {args.export_safetensors}")
+        sys.exit()
+    if args.worker:
+        work_queue(analyzer, file_path, args.run_dir, args.threads_per_worker)
+        sys.exit()
+    if args.dry_run:
+        log_progress("Planning run...")
+        plan = plan_run(
+            analyzer,
+            file_path,
+            drugs,
+            initial_keywords,
+            run_dir=args.run_dir if args.resume else None,
+            shards=args.shards,
+        )
+        log_progress(format_plan(plan))
+        atomic_write_csv(plan, os.path.join(args.run_dir, "plan.csv"))
+        sys.exit()
 
     # Step 4: Analyze reddit reviews
     log_progress("Analyzing reviews...")
-    new_comment_dict, side_effect_scores, top_k_comments = analyzer.process_file(
-        file_path, drugs, initial_keywords
-    )
-    log_progress("Saving results to files ...")
-    print(new_comment_dict)
-    print(side_effect_scores)
-    print(top_k_comments)
-
-    # Step 5: Save results to file
-    df = pd.DataFrame(
-        [
-            {"drug": drug, "side_effect": side_effect, "score": score}
-            for drug, effects in side_effect_scores.items()
-            for side_effect, score in effects.items()
-        ]
-    )
-
-    pd.DataFrame(new_comment_dict).to_csv("output/new_comment_dict.csv", index=False)
-    df.to_csv("output/side_effect_scores.csv", index=False)
-    pd.DataFrame(top_k_comments).to_csv("output/top_k_comments.csv", index=False)
+    run_dir = args.run_dir
+    if args.shards:
+        if not args.resume:
+            # A fresh run directory, so workers never reuse checkpoints or
+            # queued tasks of an earlier run
+            run_dir = os.path.join(
+                args.run_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+            )
+        log_progress(
+            f"Sharded run in {run_dir}; other machines join with "
+            f"--worker --run_dir {run_dir}"
+        )
+        # Workers checkpoint every drug; iter_results below merges the checkpoints
+        run_sharded(
+            analyzer,
+            file_path,
+            {drug: int(comment_counts.get(drug, 0)) for drug in drugs},
+            initial_keywords,
+            run_dir,
+            n_workers=args.shards,
+            threads_per_worker=args.threads_per_worker,
+        )
+    # Step 5: Write each drug's results as soon as it is scored
+    side_effect_scores = {}
+    top_k_comments = []
+    cooccurrence = None
+    if args.cooccurrence:
+        cooccurrence = CooccurrenceStats(initial_keywords, args.cooccurrence_min_count)
+    with get_writer(args.output_format, "output") as writer:
+        for result in analyzer.iter_results(
+            file_path,
+            drugs,
+            initial_keywords,
+            run_dir=run_dir,
+            resume=args.resume or bool(args.shards),
+        ):
+            writer.write(result)
+            side_effect_scores[result.drug] = result.scores
+            top_k_comments.extend(result.top_k_comments)
+            log_progress(summarize_result(result))
+            if cooccurrence is not None:
+                cooccurrence.add(
+                    result.drug, [row["side_effects"] for row in result.comments]
+                )
+    if cooccurrence is not None:
+        log_progress("Save side effect co-occurrence and drug similarity...")
+        export_cooccurrence(cooccurrence, side_effect_scores, "output")
 
     # Step 6: Calculate side effect rank for each drug
     log_progress("Calculate ranks...")
@@ -259,7 +1392,6 @@ if __name__ == "__main__":
                     comment_tmp.append(item["comment"])
             se_col.extend(se_tmp[:k])
             comment_col.extend(comment_tmp[:k])
-        print(se_col)
         comment_df = pd.DataFrame({"side_effect": se_col, "comment": comment_col})
         df = rank_df.merge(comment_df, how="left")
         log_progress(f"Save side effect scores for {drug}...")
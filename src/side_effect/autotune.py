@@ -0,0 +1,99 @@
+import logging
+import os
+import socket
+import time
+import torch
+from .file_utils import atomic_write_json, load_json
+
+PROFILE_DIR = "output/profiles"
+
+
+def profile_path(model_name, profile_dir=PROFILE_DIR):
+    """
+    Path of the tuned profile of this host and a model.
+    :param model_name: Model name or local directory.
+    :param profile_dir: Directory of the profiles (may be shared between hosts).
+    :return: Path to a JSON file.
+    """
+    model = model_name.strip("/").replace("/", "_")
+    return os.path.join(profile_dir, f"{socket.gethostname()}__{model}.json")
+
+
+def load_profile(model_name, profile_dir=PROFILE_DIR):
+    """
+    Load the tuned profile of this host and a model.
+    :return: Profile dictionary, or None if the host was never tuned.
+    """
+    return load_json(profile_path(model_name, profile_dir))
+
+
+def apply_profile(embedder, profile):
+    """
+    Apply a profile's thread count and batch limits to an embedder.
+    """
+    torch.set_num_threads(profile["threads"])
+    embedder.batch_size = profile["batch_size"]
+    embedder.max_tokens = profile["max_tokens"]
+
+
+def throughput(embedder, texts, threads, batch_size, max_tokens):
+    """
+    Comments embedded per second with the given settings.
+    """
+    torch.set_num_threads(threads)
+    embedder.batch_size = batch_size
+    embedder.max_tokens = max_tokens
+    start = time.perf_counter()
+    embedder.embed_batch(texts)
+    return len(texts) / (time.perf_counter() - start)
+
+
+def autotune(
+    embedder,
+    texts,
+    thread_grid=None,
+    batch_grid=(1, 4, 8, 16, 32, 64),
+    token_grid=(2048, 8192, 32768),
+    profile_dir=PROFILE_DIR,
+):
+    """
+    Benchmark embedding settings on a sample of the corpus and save the fastest
+    as this host's profile. The grid is searched one setting at a time: threads
+    first, then batch size, then the token budget per batch.
+    :param embedder: BioBERTEmbedder.
+    :param texts: Sample of cleaned comments (a few hundred is enough).
+    :param thread_grid: Torch thread counts to try; defaults to powers of two up
+                        to the number of CPU cores.
+    :param batch_grid: Batch sizes to try.
+    :param token_grid: Maximum padded tokens per batch to try.
+    :param profile_dir: Directory of the profiles.
+    :return: Profile dictionary, including the throughput of every trial.
+    """
+    if thread_grid is None:
+        cores = os.cpu_count() or 1
+        thread_grid = sorted({min(2**i, cores) for i in range(cores.bit_length())})
+    embedder.embed_batch(texts[:4])  # warm up
+    best = {"threads": thread_grid[-1], "batch_size": 8, "max_tokens": 8192}
+    trials = []
+    for name, grid in [
+        ("threads", thread_grid),
+        ("batch_size", batch_grid),
+        ("max_tokens", token_grid),
+    ]:
+        scores = {}
+        for value in grid:
+            settings = {**best, name: value}
+            scores[value] = throughput(embedder, texts, **settings)
+            trials.append({**settings, "comments_per_second": scores[value]})
+            logging.info(f"Autotune {settings}: {scores[value]:.1f} comments/s")
+        best[name] = max(scores, key=scores.get)
+    profile = {
+        **best,
+        "host": socket.gethostname(),
+        "model": embedder.model_name,
+        "comments_per_second": max(t["comments_per_second"] for t in trials),
+        "trials": trials,
+    }
+    atomic_write_json(profile, profile_path(embedder.model_name, profile_dir))
+    apply_profile(embedder, profile)
+    return profile
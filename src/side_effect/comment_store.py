@@ -0,0 +1,178 @@
+import numpy as np
+import pandas as pd
+
+
+class CommentStore:
+    def __init__(self, df, drug_col="Drug Name"):
+        """
+        Columnar store of comments, sorted by drug so that each drug's comments
+        occupy one contiguous row range.
+        :param df: Pandas DataFrame with a drug column, 'Review Text' and
+                   'cleaned_comments'. Other columns are kept for export.
+        :param drug_col: Name of the drug column.
+        """
+        codes, drugs = pd.factorize(df[drug_col], sort=True)
+        order = np.argsort(codes, kind="stable")
+        self.drug_col = drug_col
+        self.drug_codes = codes[order]
+        self.drugs = np.asarray(drugs)
+        self.columns = {
+            col: df[col].to_numpy(dtype=object)[order]
+            for col in df.columns
+            if col != "side_effects"
+        }
+        bounds = np.searchsorted(self.drug_codes, np.arange(len(self.drugs) + 1))
+        self.index = {
+            drug: (bounds[code], bounds[code + 1]) for code, drug in enumerate(drugs)
+        }
+        # drug code -> side effect -> list of arrays of assigned row ids, in
+        # assignment order
+        self.assignments = {}
+
+    def __len__(self):
+        return len(self.drug_codes)
+
+    @property
+    def cleaned_comments(self):
+        return self.columns["cleaned_comments"]
+
+    @property
+    def review_text(self):
+        return self.columns["Review Text"]
+
+    def drug(self, drug_name):
+        """
+        Return an O(1) view over the comments of one drug.
+        :param drug_name: Name of the drug.
+        :return: DrugView (empty if the drug has no comments).
+        """
+        start, stop = self.index.get(drug_name, (0, 0))
+        return DrugView(self, start, stop)
+
+    def drug_range(self, start, stop):
+        """
+        Codes of the drugs with rows in a row range.
+        """
+        if stop <= start:
+            return range(0)
+        return range(int(self.drug_codes[start]), int(self.drug_codes[stop - 1]) + 1)
+
+    def add_side_effect(self, rows, side_effect):
+        """
+        Record that the given rows mention a side effect.
+        :param rows: Array of store row ids.
+        :param side_effect: Side effect name.
+        """
+        rows = np.asarray(rows)
+        codes = self.drug_codes[rows]
+        for code in np.unique(codes):
+            drug_assignments = self.assignments.setdefault(int(code), {})
+            drug_assignments.setdefault(side_effect, []).append(rows[codes == code])
+
+    def side_effect_rows(self, side_effect, start=0, stop=None):
+        """
+        Sorted row ids of a row range that were assigned a side effect. Only the
+        assignments of the drugs in the range are read.
+        """
+        stop = len(self) if stop is None else stop
+        chunks = [
+            chunk
+            for code in self.drug_range(start, stop)
+            for chunk in self.assignments.get(code, {}).get(side_effect, [])
+        ]
+        rows = np.concatenate(chunks) if chunks else np.empty(0, dtype=np.int64)
+        return np.sort(rows[(rows >= start) & (rows < stop)])
+
+    def side_effect_lists(self, start, stop):
+        """
+        Materialize the per-row side effect lists of a row range. Only the
+        assignments of the drugs in the range are read.
+        """
+        lists = [[] for _ in range(stop - start)]
+        for code in self.drug_range(start, stop):
+            for side_effect, chunks in self.assignments.get(code, {}).items():
+                rows = np.concatenate(chunks)
+                for row in rows[(rows >= start) & (rows < stop)]:
+                    lists[row - start].append(side_effect)
+        return lists
+
+    def clear_side_effects(self, start, stop):
+        """
+        Drop the assignments of the drugs in a row range, e.g. once their rows
+        have been exported.
+        """
+        for code in self.drug_range(start, stop):
+            self.assignments.pop(code, None)
+
+    def to_records(self, start=0, stop=None):
+        """
+        Materialize rows as a list of dictionaries (for export only).
+        :param start: First row.
+        :param stop: End row (exclusive); defaults to the end of the store.
+        :return: List of row dictionaries including 'side_effects'.
+        """
+        stop = len(self) if stop is None else stop
+        records = pd.DataFrame(
+            {col: values[start:stop] for col, values in self.columns.items()}
+        ).to_dict(orient="records")
+        for record, side_effects in zip(records, self.side_effect_lists(start, stop)):
+            record["side_effects"] = side_effects
+        return records
+
+
+class DrugView:
+    def __init__(self, store, start, stop):
+        """
+        View over the contiguous rows of one drug in a CommentStore.
+        """
+        self.store = store
+        self.start = start
+        self.stop = stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    @property
+    def comments(self):
+        return self.store.cleaned_comments[self.start : self.stop]
+
+    @property
+    def review_text(self):
+        return self.store.review_text[self.start : self.stop]
+
+    def column(self, name):
+        """
+        Values of any stored column for the view's rows.
+        """
+        return self.store.columns[name][self.start : self.stop]
+
+    @property
+    def drug_names(self):
+        return self.store.drugs[self.store.drug_codes[self.start : self.stop]]
+
+    def add_side_effect(self, idx, side_effect):
+        """
+        Record a side effect for comments given by their position in the view.
+        :param idx: Array of positions within the view.
+        :param side_effect: Side effect name.
+        """
+        self.store.add_side_effect(self.start + np.asarray(idx), side_effect)
+
+    def side_effect_idx(self, side_effect):
+        """
+        Positions within the view of the comments assigned a side effect.
+        """
+        rows = self.store.side_effect_rows(side_effect, self.start, self.stop)
+        return rows - self.start
+
+    def to_records(self):
+        """
+        Materialize the view's rows as a list of dictionaries (for export only).
+        """
+        return self.store.to_records(self.start, self.stop)
+
+    def clear_side_effects(self):
+        """
+        Drop the view's side effect assignments.
+        """
+        self.store.clear_side_effects(self.start, self.stop)
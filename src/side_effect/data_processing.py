@@ -1,10 +1,13 @@
 import pandas as pd
+from .review_db import ReviewDatabase
 from .side_effect import (
     get_comment_dict,
+    get_comment_store,
     pick_drug,
     merge_data,
     remove_comment,
     remove_positive_comments,
+    remove_near_duplicates,
 )
 
 
@@ -17,6 +20,29 @@ def load_data(file_path):
     return pd.read_csv(file_path)
 
 
+def is_review_db(file_path):
+    """
+    Whether a path points to a SQLite review database rather than a CSV file.
+    """
+    return str(file_path).endswith((".db", ".sqlite"))
+
+
+def load_reviews(file_path, drugs=None):
+    """
+    Loads the reviews of selected drugs from a CSV file or a SQLite review database.
+    With a database, only the rows of the selected drugs are read.
+    :param file_path: Path to the CSV file or SQLite database.
+    :param drugs: List of drug names, or None for all reviews.
+    :return: Pandas DataFrame of the reviews.
+    """
+    if is_review_db(file_path):
+        return ReviewDatabase(file_path).load_reviews(drugs)
+    data = load_data(file_path)
+    if drugs is not None:
+        data = data[data["Drug Name"].isin(list(drugs))]
+    return data
+
+
 def prepare_comment_dict(
     data, comment_col_name="Review Text", cleaned_data=False, lim=30
 ):
@@ -30,10 +56,22 @@ def prepare_comment_dict(
     return get_long_comment(dict, lim)
 
 
+def prepare_comment_store(data, comment_col_name="Review Text", lim=30):
+    """
+    Cleans and preprocesses comments into a columnar, drug-indexed comment store.
+    :param data: Pandas DataFrame containing review data.
+    :param comment_col_name: The name of the column containing comments.
+    :param lim: Comments with at most this many words are dropped.
+    :return: CommentStore ready for analysis.
+    """
+    return get_comment_store(data, comment_col_name, lim)
+
+
 def filter_comments_by_drug(comment_dict, drug_name):
     """
     Filters comments for a specific drug name.
-    :param comment_dict: List of dictionaries containing comments and metadata.
+    :param comment_dict: List of dictionaries containing comments and metadata,
+                         or a CommentStore (an O(1) view is returned).
     :param drug_name: Name of the drug to filter.
     :return: Filtered comment dictionary and list of cleaned comments.
     """
@@ -87,3 +125,18 @@ def get_negative_comment(df):
     pd.DataFrame: A DataFrame containing rows with negative sentiment scores.
     """
     return remove_positive_comments(df)
+
+
+def get_deduplicated_comment(df, threshold=0.8):
+    """
+    Remove near-duplicate comments for each drug using MinHash LSH.
+
+    Parameters:
+    df (pd.DataFrame): A DataFrame containing 'Drug Name' and 'cleaned_comments' columns.
+    threshold (float): Jaccard similarity above which comments are near-duplicates.
+
+    Returns:
+    pd.DataFrame: A DataFrame with one comment per near-duplicate cluster and a
+    'duplicate_count' column.
+    """
+    return remove_near_duplicates(df, threshold=threshold)
@@ -2,15 +2,25 @@ import pandas as pd
 import os
 import re
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from .file_utils import atomic_write_csv, atomic_write_json, file_digest, load_json
+
+REMOVED_COMMENTS = ["[ Removed by Reddit ]", "[deleted]", "[removed]"]
+MANIFEST_NAME = ".manifest.json"
 
 
 class SideEffectProcessor:
-    def __init__(self, input_dir, output_dir):
+    def __init__(self, input_dir, output_dir, n_workers=1):
         """
         Initializes the processor with input and output directories.
+        :param input_dir: Directory containing raw Reddit CSV dumps.
+        :param output_dir: Directory where cleaned CSV files are written.
+        :param n_workers: Number of worker processes used by process_directory.
         """
         self.input_dir = input_dir
         self.output_dir = output_dir
+        self.n_workers = n_workers
+        self.manifest_path = os.path.join(output_dir, MANIFEST_NAME)
         os.makedirs(output_dir, exist_ok=True)  # Ensure output directory exists
 
     @staticmethod
@@ -26,6 +36,17 @@ class SideEffectProcessor:
         text = text.lower()  # Convert to lowercase
         return text.strip()
 
+    @staticmethod
+    def preprocess_series(texts):
+        """
+        Vectorized version of preprocess_text for a whole Series of texts.
+        """
+        texts = texts.str.replace("-", " ", regex=False)
+        texts = texts.str.replace("_", " ", regex=False)
+        texts = texts.str.replace(r"[^\w\s]", "", regex=True)
+        texts = texts.str.replace(r"\d+", "", regex=True)
+        return texts.str.lower().str.strip()
+
     @staticmethod
     def extract_drug_name(file_name):
         """
@@ -39,27 +60,26 @@ class SideEffectProcessor:
     def process_file(self, file_path):
         """
         Reads a CSV file, processes the data, and writes it to a new CSV file.
+        :return: Path of the written output file.
         """
         # Read the CSV file
-        df = pd.read_csv(file_path)
+        df = pd.read_csv(file_path, usecols=["Post Title", "Comment"])
 
         # Remove rows where Comment contains '[ Removed by Reddit ]' or '[deleted]'
-        df = df[
-            ~df["Comment"].isin(["[ Removed by Reddit ]", "[deleted]", "[removed]"])
-        ]
+        df = df[~df["Comment"].isin(REMOVED_COMMENTS)]
 
         # Extract drug name from the file name
         drug_name = self.extract_drug_name(file_path)
 
-        title_to_comment = df["Post Title"].unique().tolist()
-        comments = df["Comment"].unique().tolist()
-        # print(len(df['Post Title']), len(df["Comment"]), len(comments), len(title_to_comment))
-        title_to_comment.extend(comments)
-        df = pd.DataFrame({"Review Text": title_to_comment})
-        # print(df)
+        # Unique titles followed by unique comments
+        review_text = pd.concat(
+            [df["Post Title"].drop_duplicates(), df["Comment"].drop_duplicates()],
+            ignore_index=True,
+        )
+        df = pd.DataFrame({"Review Text": review_text})
 
         # Clean the combined comments
-        df["cleaned_comments"] = df["Review Text"].apply(self.preprocess_text)
+        df["cleaned_comments"] = self.preprocess_series(df["Review Text"])
 
         # Add the 'Drug Name' and 'side_effects' columns
         df["Drug Name"] = drug_name
@@ -72,15 +92,78 @@ class SideEffectProcessor:
 
         # Save to a new CSV file in the output directory
         output_file = os.path.join(self.output_dir, os.path.basename(file_path))
-        processed_df.to_csv(output_file, index=False)
+        atomic_write_csv(processed_df, output_file)
         print(f"Processed data saved to: {output_file}")
+        return output_file
+
+    def _process_entry(self, file_path):
+        """
+        Processes one file and returns its manifest record.
+        """
+        stat = os.stat(file_path)
+        digest = file_digest(file_path)
+        output_file = self.process_file(file_path)
+        return {
+            "mtime": stat.st_mtime,
+            "size": stat.st_size,
+            "sha256": digest,
+            "output": os.path.basename(output_file),
+        }
 
-    def process_directory(self):
+    def is_up_to_date(self, file_name, manifest):
+        """
+        Checks whether a raw file was already processed with its current content.
+        Unchanged mtime and size are trusted directly; otherwise the content hash
+        is compared, so files that were only touched are not reprocessed.
+        :param file_name: Name of the file inside the input directory.
+        :param manifest: Manifest dictionary loaded from the output directory.
+        :return: True if the recorded output is still valid.
+        """
+        record = manifest.get(file_name)
+        if record is None:
+            return False
+        if not os.path.exists(os.path.join(self.output_dir, record["output"])):
+            return False
+        stat = os.stat(os.path.join(self.input_dir, file_name))
+        if record["mtime"] == stat.st_mtime and record["size"] == stat.st_size:
+            return True
+        if record["sha256"] == file_digest(os.path.join(self.input_dir, file_name)):
+            record["mtime"], record["size"] = stat.st_mtime, stat.st_size
+            return True
+        return False
+
+    def process_directory(self, force=False):
         """
         Processes all CSV files in the input directory and saves the results
-        to the output directory.
+        to the output directory. Files whose content matches the manifest are
+        skipped unless force is set; the rest run on n_workers processes.
+        :param force: Reprocess every file regardless of the manifest.
+        :return: List of file names that were processed.
         """
-        for file in os.listdir(self.input_dir):
-            if file.endswith(".csv"):
-                file_path = os.path.join(self.input_dir, file)
-                self.process_file(file_path)
+        manifest = {} if force else load_json(self.manifest_path, default={})
+        files = sorted(
+            file for file in os.listdir(self.input_dir) if file.endswith(".csv")
+        )
+        pending = [file for file in files if not self.is_up_to_date(file, manifest)]
+        print(
+            f"{len(files) - len(pending)} files up to date, {len(pending)} to process"
+        )
+
+        paths = {file: os.path.join(self.input_dir, file) for file in pending}
+        if self.n_workers > 1 and len(pending) > 1:
+            with ProcessPoolExecutor(max_workers=self.n_workers) as executor:
+                futures = {
+                    executor.submit(self._process_entry, path): file
+                    for file, path in paths.items()
+                }
+                for future in as_completed(futures):
+                    manifest[futures[future]] = future.result()
+                    atomic_write_json(manifest, self.manifest_path)
+        else:
+            for file, path in paths.items():
+                manifest[file] = self._process_entry(path)
+                atomic_write_json(manifest, self.manifest_path)
+
+        # Persist mtime refreshes of touched-but-unchanged files
+        atomic_write_json(manifest, self.manifest_path)
+        return pending
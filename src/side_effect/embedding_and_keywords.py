@@ -1,16 +1,46 @@
 from transformers import AutoTokenizer, AutoModel
 from sklearn.metrics.pairwise import cosine_similarity
 from nltk.corpus import wordnet
+from scipy.sparse import csr_matrix
+import logging
+import numpy as np
 import torch
+from .autotune import load_profile, apply_profile
 
 
 class BioBERTEmbedder:
-    def __init__(self, model_name="dmis-lab/biobert-base-cased-v1.2"):
+    def __init__(
+        self,
+        model_name="dmis-lab/biobert-base-cased-v1.2",
+        batch_size=8,
+        max_tokens=8192,
+        load_tuned=True,
+    ):
         """
         Initializes the BioBERT model and tokenizer.
+        :param model_name: Model name or local directory.
+        :param batch_size: Maximum number of texts per forward pass in embed_batch.
+        :param max_tokens: Maximum padded tokens per forward pass in embed_batch.
+        :param load_tuned: Apply the autotuned profile of this host and model, if any.
         """
+        self.model_name = model_name
         self.tokenizer = AutoTokenizer.from_pretrained(model_name)
         self.model = AutoModel.from_pretrained(model_name)
+        self.batch_size = batch_size
+        self.max_tokens = max_tokens
+        if load_tuned:
+            profile = load_profile(model_name)
+            if profile is not None:
+                apply_profile(self, profile)
+
+    def save_safetensors(self, path):
+        """
+        Save the model as memory-mappable safetensors weights, together with its
+        tokenizer, so it can be loaded from the directory with model_name=path.
+        :param path: Output directory.
+        """
+        self.model.save_pretrained(path, safe_serialization=True)
+        self.tokenizer.save_pretrained(path)
 
     def get_embeddings(self, text):
         """
@@ -24,16 +54,93 @@ class BioBERTEmbedder:
         outputs = self.model(**inputs)
         return outputs.last_hidden_state.mean(dim=1).detach().numpy()
 
+    def _forward(self, token_ids):
+        """
+        Mean-pooled last hidden states of a padded batch, ignoring padding.
+        """
+        inputs = self.tokenizer.pad({"input_ids": token_ids}, return_tensors="pt")
+        with torch.no_grad():
+            hidden = self.model(**inputs).last_hidden_state
+        mask = inputs["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+        return ((hidden * mask).sum(dim=1) / mask.sum(dim=1)).numpy()
+
+    def embed_batch(self, texts):
+        """
+        Generate BioBERT embeddings for many texts, equal to get_embeddings on each
+        text. Texts are sorted by length and packed into batches of at most
+        batch_size texts and max_tokens padded tokens. When a batch runs out of
+        memory, the batch limits are halved and the batch is retried.
+        :param texts: List of input texts.
+        :return: NumPy array of shape (len(texts), hidden_size).
+        """
+        texts = list(texts)
+        embeddings = np.empty(
+            (len(texts), self.model.config.hidden_size), dtype=np.float32
+        )
+        if not texts:
+            return embeddings
+        token_ids = self.tokenizer(texts, truncation=True, max_length=512)["input_ids"]
+        lengths = np.array([len(ids) for ids in token_ids])
+        order = np.argsort(lengths, kind="stable")
+        start = 0
+        while start < len(order):
+            # Batches are sorted by length, so the last text sets the padding
+            stop = min(start + self.batch_size, len(order))
+            budget = np.arange(1, stop - start + 1) * lengths[order[start:stop]]
+            stop = start + max(1, int((budget <= self.max_tokens).sum()))
+            batch = order[start:stop]
+            try:
+                embeddings[batch] = self._forward([token_ids[i] for i in batch])
+            except (RuntimeError, MemoryError) as error:
+                oom = isinstance(error, MemoryError) or "memory" in str(error).lower()
+                if not oom or len(batch) == 1:
+                    raise
+                self.batch_size = max(1, len(batch) // 2)
+                self.max_tokens = max(512, self.max_tokens // 2)
+                logging.warning(
+                    f"Out of memory with {len(batch)} texts per batch; retrying with "
+                    f"batch_size={self.batch_size}, max_tokens={self.max_tokens}"
+                )
+                continue
+            start = stop
+        return embeddings
+
+    def get_static_embeddings(self, texts):
+        """
+        Generate cheap static embeddings for a list of texts by mean-pooling the
+        model's input token embeddings, without running the transformer layers.
+        :param texts: List of input texts.
+        :return: NumPy array of shape (len(texts), hidden_size).
+        """
+        weights = self.model.get_input_embeddings().weight.detach().numpy()
+        token_ids = self.tokenizer(list(texts), truncation=True, max_length=512)[
+            "input_ids"
+        ]
+        lengths = np.array([len(ids) for ids in token_ids])
+        rows = np.repeat(np.arange(len(token_ids)), lengths)
+        cols = np.concatenate(token_ids) if len(token_ids) else np.array([], int)
+        counts = csr_matrix(
+            (np.ones(len(cols), dtype=weights.dtype), (rows, cols)),
+            shape=(len(token_ids), weights.shape[0]),
+        )
+        return np.asarray(counts @ weights) / np.maximum(lengths, 1)[:, None]
+
 
 class KeywordExpander:
-    def __init__(self, embedder: BioBERTEmbedder, side_effects_official):
+    def __init__(
+        self, embedder: BioBERTEmbedder, side_effects_official, threshold=0.8, top_k=10
+    ):
         """
         Initializes the KeywordExpander with a BioBERT embedder and official side effects.
         :param embedder: An instance of BioBERTEmbedder.
         :param side_effects_official: List of official side effects.
+        :param threshold: Minimum similarity of an expanded keyword.
+        :param top_k: Maximum number of expanded keywords per side effect.
         """
         self.embedder = embedder
         self.side_effects_official = side_effects_official
+        self.threshold = threshold
+        self.top_k = top_k
 
     def get_wordnet_synonyms(self, initial_keywords):
         """
@@ -86,6 +193,8 @@ class KeywordExpander:
             reference_words = list(
                 set(synonyms_kw[word] + self.side_effects_official + [word])
             )
-            similar_words_emb = self.find_similar_words(word, reference_words)
+            similar_words_emb = self.find_similar_words(
+                word, reference_words, self.threshold, self.top_k
+            )
             synonyms_kw[word] = similar_words_emb
         return synonyms_kw
@@ -0,0 +1,106 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import numpy as np
+
+
+def file_digest(file_path, chunk_size=1 << 20):
+    """
+    Compute the SHA-256 digest of a file's content.
+    :param file_path: Path to the file.
+    :param chunk_size: Number of bytes read at a time.
+    :return: Hex digest string.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def safe_filename(name):
+    """
+    File name for an arbitrary name such as a drug. Characters outside letters,
+    digits, '.', '_' and '-' (e.g. the '/' of "amphetamine/dextroamphetamine")
+    are replaced and a leading '.' is escaped, so the file stays inside its
+    directory; a changed name gets a short hash of the original so distinct
+    names never share a file.
+    :param name: Name to encode.
+    :return: File name without extension.
+    """
+    safe = re.sub(r"[^\w.-]", "_", name)
+    if safe.startswith("."):
+        safe = "_" + safe
+    if safe == name:
+        return name
+    return f"{safe}-{hashlib.sha256(name.encode('utf-8')).hexdigest()[:8]}"
+
+
+def atomic_write(file_path, write_fn, mode="w"):
+    """
+    Write a file atomically: data goes to a temporary file in the same directory,
+    which then replaces the target, so readers never see a half-written file.
+    :param file_path: Destination path.
+    :param write_fn: Callable receiving the open temporary file object.
+    :param mode: File mode used to open the temporary file.
+    """
+    directory = os.path.dirname(os.path.abspath(file_path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(
+        dir=directory, prefix=f".{os.path.basename(file_path)}.", suffix=".tmp"
+    )
+    try:
+        text_kwargs = {} if "b" in mode else {"encoding": "utf-8", "newline": ""}
+        with os.fdopen(fd, mode, **text_kwargs) as f:
+            write_fn(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def atomic_write_csv(df, file_path, **kwargs):
+    """
+    Atomically save a DataFrame as CSV.
+    :param df: Pandas DataFrame to save.
+    :param file_path: Destination path.
+    :param kwargs: Extra arguments passed to DataFrame.to_csv.
+    """
+    kwargs.setdefault("index", False)
+    atomic_write(file_path, lambda f: df.to_csv(f, **kwargs))
+
+
+def json_default(obj):
+    """
+    Convert NumPy scalars and arrays to plain Python objects for JSON.
+    """
+    if isinstance(obj, (np.generic, np.ndarray)):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def atomic_write_json(obj, file_path):
+    """
+    Atomically save an object as JSON.
+    :param obj: JSON-serializable object (NumPy values are converted).
+    :param file_path: Destination path.
+    """
+    atomic_write(file_path, lambda f: json.dump(obj, f, indent=2, default=json_default))
+
+
+def load_json(file_path, default=None):
+    """
+    Load a JSON file, returning a default when the file does not exist.
+    :param file_path: Path to the JSON file.
+    :param default: Value returned if the file is missing.
+    :return: Parsed JSON object or the default.
+    """
+    if not os.path.exists(file_path):
+        return default
+    with open(file_path, "r", encoding="utf-8") as f:
+        return json.load(f)
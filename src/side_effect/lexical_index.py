@@ -0,0 +1,139 @@
+import numpy as np
+import pandas as pd
+from .side_effect import preprocess_text
+
+
+class InvertedIndex:
+    def __init__(self, comments, groups=None, chunk_size=50000):
+        """
+        Token inverted index over cleaned comments. Postings of each term are a
+        slice of two flat arrays (document ids sorted ascending and term
+        frequencies), so the whole index is a handful of compact NumPy arrays.
+        :param comments: Array of cleaned comments (whitespace tokenized).
+        :param groups: Optional array with the drug of each comment, enabling
+                       per-drug term statistics.
+        :param chunk_size: Number of comments tokenized at once, which bounds the
+                           memory taken by Python token strings during the build.
+        """
+        self.n_docs = len(comments)
+        self.vocabulary = {}
+        lengths, terms, docs, tfs = [], [], [], []
+        for start in range(0, self.n_docs, chunk_size):
+            tokens = [str(c).split() for c in comments[start : start + chunk_size]]
+            chunk_lengths = np.fromiter(map(len, tokens), dtype=np.int32)
+            codes, uniques = pd.factorize(
+                pd.Series([token for doc in tokens for token in doc], dtype=object)
+            )
+            term_ids = np.array(
+                [
+                    self.vocabulary.setdefault(term, len(self.vocabulary))
+                    for term in uniques
+                ],
+                dtype=np.int64,
+            )[codes]
+            doc_ids = np.repeat(
+                np.arange(start, start + len(tokens), dtype=np.int64), chunk_lengths
+            )
+            # Unique (term, doc) pairs of the chunk with their counts
+            pairs, tf = np.unique(term_ids * self.n_docs + doc_ids, return_counts=True)
+            lengths.append(chunk_lengths)
+            terms.append((pairs // self.n_docs).astype(np.int32))
+            docs.append((pairs % self.n_docs).astype(np.int32))
+            tfs.append(tf.astype(np.int32))
+
+        self.doc_lengths = np.concatenate(lengths or [np.empty(0, dtype=np.int32)])
+        self.avg_length = self.doc_lengths.mean() if self.n_docs else 0.0
+        terms = np.concatenate(terms or [np.empty(0, dtype=np.int32)])
+        # Chunks cover increasing doc ids, so a stable sort by term keeps each
+        # term's postings sorted by document
+        order = np.argsort(terms, kind="stable")
+        self.doc_ids = np.concatenate(docs or [np.empty(0, dtype=np.int32)])[order]
+        self.tf = np.concatenate(tfs or [np.empty(0, dtype=np.int32)])[order]
+        self.term_ptr = np.searchsorted(
+            terms[order], np.arange(len(self.vocabulary) + 1)
+        )
+        self.doc_freq = np.diff(self.term_ptr)
+
+        self.group_codes = self.groups = None
+        if groups is not None:
+            self.group_codes, groups = pd.factorize(np.asarray(groups))
+            self.groups = pd.Index(groups)
+
+    def __len__(self):
+        return self.n_docs
+
+    def postings(self, term, start=0, stop=None):
+        """
+        Documents containing a term, optionally restricted to a row range.
+        :param term: Token.
+        :param start: First document id.
+        :param stop: End document id (exclusive); defaults to the last document.
+        :return: Tuple (sorted document ids, term frequencies).
+        """
+        term_id = self.vocabulary.get(term)
+        if term_id is None:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32)
+        lo, hi = self.term_ptr[term_id], self.term_ptr[term_id + 1]
+        docs = self.doc_ids[lo:hi]
+        stop = self.n_docs if stop is None else stop
+        i, j = lo + np.searchsorted(docs, [start, stop])
+        return self.doc_ids[i:j], self.tf[i:j]
+
+    def idf(self, term):
+        """
+        BM25 inverse document frequency of a term over the whole index.
+        """
+        term_id = self.vocabulary.get(term)
+        df = 0 if term_id is None else self.doc_freq[term_id]
+        return np.log(1 + (self.n_docs - df + 0.5) / (df + 0.5))
+
+    def bm25(self, query, start=0, stop=None, k1=1.2, b=0.75):
+        """
+        BM25 scores of a keyword (or phrase, scored as a bag of tokens) for a
+        range of documents, e.g. the contiguous rows of one drug.
+        :param query: Keyword, preprocessed like the comments.
+        :param start: First document id.
+        :param stop: End document id (exclusive); defaults to the last document.
+        :param k1: Term frequency saturation.
+        :param b: Document length normalization.
+        :return: Array of scores of shape (stop - start,); 0 for documents
+                 without any query token.
+        """
+        stop = self.n_docs if stop is None else stop
+        scores = np.zeros(stop - start)
+        for term in set(preprocess_text(query).split()):
+            docs, tf = self.postings(term, start, stop)
+            if len(docs) == 0:
+                continue
+            norm = k1 * (1 - b + b * self.doc_lengths[docs] / self.avg_length)
+            scores[docs - start] += self.idf(term) * tf * (k1 + 1) / (tf + norm)
+        return scores
+
+    def term_stats(self, group=None):
+        """
+        Term frequency (total occurrences) and document frequency of every term,
+        over the whole index or within one drug.
+        :param group: Drug name, or None for the whole index.
+        :return: Pandas DataFrame with 'term', 'tf' and 'df' columns, sorted by
+                 decreasing df.
+        """
+        terms = np.repeat(np.arange(len(self.vocabulary)), self.doc_freq)
+        tf = self.tf
+        if group is not None:
+            if self.groups is None:
+                raise ValueError("The index was built without groups")
+            code = self.groups.get_loc(group) if group in self.groups else -1
+            mask = self.group_codes[self.doc_ids] == code
+            terms, tf = terms[mask], tf[mask]
+        n_terms = len(self.vocabulary)
+        stats = pd.DataFrame(
+            {
+                "term": list(self.vocabulary),
+                "tf": np.bincount(terms, weights=tf, minlength=n_terms).astype(int),
+                "df": np.bincount(terms, minlength=n_terms),
+            }
+        )
+        stats = stats[stats["df"] > 0]
+        return stats.sort_values(["df", "term"], ascending=[False, True]).reset_index(
+            drop=True
+        )
@@ -0,0 +1,203 @@
+import time
+import numpy as np
+import pandas as pd
+from .data_processing import load_reviews, prepare_comment_store, is_review_db
+from .review_db import ReviewDatabase
+from .sharding import split_shards
+
+
+def calibrate(embedder, lengths=(8, 32, 64, 128, 256, 512), repeats=3):
+    """
+    Time batched embedding of texts of several input lengths with the embedder's
+    current batch settings, and fit seconds per text as a quadratic in the token
+    count (attention is quadratic).
+    :param embedder: BioBERTEmbedder.
+    :param lengths: Target token counts.
+    :param repeats: Timed runs per length; the fastest is kept.
+    :return: Array of polynomial coefficients, highest degree first.
+    """
+    token_counts, seconds = [], []
+    embedder.embed_batch(["warm up"])
+    for length in lengths:
+        text = " ".join(["pain"] * length)
+        n_tokens = len(
+            embedder.tokenizer(text, truncation=True, max_length=512)["input_ids"]
+        )
+        texts = [text] * max(1, min(embedder.batch_size, 2048 // n_tokens))
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            embedder.embed_batch(texts)
+            timings.append((time.perf_counter() - start) / len(texts))
+        token_counts.append(n_tokens)
+        seconds.append(min(timings))
+    return np.polyfit(token_counts, seconds, 2)
+
+
+def forward_seconds(calibration, token_counts):
+    """
+    Predicted total time of forward passes.
+    :param calibration: Coefficients from calibrate.
+    :param token_counts: Array of token counts, one per pass.
+    :return: Seconds.
+    """
+    token_counts = np.asarray(token_counts, dtype=np.float64)
+    return float(np.maximum(np.polyval(calibration, token_counts), 0).sum())
+
+
+def activation_bytes(config, length, batch_size=1):
+    """
+    Approximate memory held by one batched forward pass. Inference runs without
+    autograd, so only about one layer's attention and feed-forward tensors are
+    alive at a time.
+    :param config: Model config (hidden_size, intermediate_size, heads).
+    :param length: Padded token count.
+    :param batch_size: Texts per batch.
+    :return: Bytes.
+    """
+    per_layer = (
+        length * (6 * config.hidden_size + 2 * config.intermediate_size)
+        + 2 * config.num_attention_heads * length**2
+    )
+    return 4 * batch_size * per_layer
+
+
+def token_lengths(tokenizer, texts):
+    """
+    Token ids of texts as the model sees them (truncated to 512 tokens).
+    :return: List of token id lists.
+    """
+    if len(texts) == 0:
+        return []
+    return tokenizer(list(texts), truncation=True, max_length=512)["input_ids"]
+
+
+def plan_run(analyzer, file_path, drugs, initial_keywords, run_dir=None, shards=None):
+    """
+    Predict the cost of analyzing each drug without running the model on the
+    corpus. Comments and token counts are read exactly as iter_results would see
+    them; forward pass time comes from a short calibration of the local model.
+    Drugs checkpointed in run_dir cost nothing, and with a review database the
+    comments whose embeddings are cached are not counted as forward passes.
+    Cascade mode with a fixed fraction scales comment passes by the expected
+    share of candidates; other adaptive modes are costed as the exact path,
+    an upper bound.
+    :param analyzer: SideEffectAnalyzer with its model loaded.
+    :param file_path: Path to the CSV file or SQLite review database.
+    :param drugs: List of drug names.
+    :param initial_keywords: List of side effects to score.
+    :param run_dir: Run directory whose checkpoints are reused.
+    :param shards: If given, assign drugs to this many shards by predicted time.
+    :return: Pandas DataFrame with one row per drug.
+    """
+    analyzer.initial_keywords = initial_keywords
+    embedder = analyzer.embedder
+    config = embedder.model.config
+    model_bytes = sum(
+        param.numel() * param.element_size() for param in embedder.model.parameters()
+    )
+    calibration = calibrate(embedder)
+
+    # Keyword expansion embeds each side effect and all its reference words,
+    # again for each drug
+    expander = analyzer.keyword_expander
+    synonyms = expander.get_wordnet_synonyms(initial_keywords)
+    expand_words = []
+    for kw in initial_keywords:
+        reference_words = set(synonyms[kw] + expander.side_effects_official + [kw])
+        expand_words += [kw] + list(reference_words)
+    expand_tokens = [
+        len(ids) for ids in token_lengths(embedder.tokenizer, expand_words)
+    ]
+    expand_s = forward_seconds(calibration, expand_tokens)
+    # At most top_k expanded keywords per side effect are embedded again for scoring
+    n_expanded = expander.top_k * len(initial_keywords)
+    score_s = forward_seconds(calibration, [np.mean(expand_tokens or [3])] * n_expanded)
+
+    store = prepare_comment_store(load_reviews(file_path, drugs), "cleaned_comments")
+    cached_ids = np.empty(0, dtype=np.int64)
+    # Only the exact and approximate paths read the embedding cache
+    uses_cache = not (analyzer.cascade or analyzer.hybrid or analyzer.out_of_core)
+    if is_review_db(file_path) and uses_cache:
+        cached_ids = ReviewDatabase(file_path).embedded_ids(analyzer.model_name)
+    share = 1.0
+    if analyzer.cascade and analyzer.cascade_fraction is not None:
+        share = min(1.0, analyzer.cascade_fraction * len(initial_keywords))
+
+    signature = None
+    if run_dir is not None:
+        signature = analyzer.run_signature(analyzer.data_version(file_path))
+    rows = []
+    for drug in drugs:
+        view = store.drug(drug)
+        token_ids = token_lengths(embedder.tokenizer, view.comments)
+        lengths = np.array([len(ids) for ids in token_ids], dtype=np.int64)
+        cached = np.zeros(len(view), dtype=bool)
+        if len(cached_ids) and "review_id" in store.columns:
+            cached = np.isin(view.column("review_id").astype(np.int64), cached_ids)
+        checkpointed = (
+            run_dir is not None
+            and analyzer.load_checkpoint(run_dir, drug, signature) is not None
+        )
+        todo = 0.0 if checkpointed else 1.0
+        new_lengths = lengths[~cached]
+        row = {
+            "drug": drug,
+            "comments": len(view),
+            "checkpointed": checkpointed,
+            "cached_embeddings": int(cached.sum()),
+            "tokens": int(lengths.sum()),
+            "max_tokens": int(lengths.max(initial=0)),
+            "vocabulary": len(np.unique(np.concatenate(token_ids or [[]]))),
+            "expand_passes": int(todo * len(expand_words)),
+            "embed_passes": int(np.ceil(todo * share * len(new_lengths))),
+            "embed_tokens": int(np.ceil(todo * share * new_lengths.sum())),
+            "score_passes": int(todo * n_expanded),
+            "expand_s": todo * expand_s,
+            "embed_s": todo * share * forward_seconds(calibration, new_lengths),
+            "score_s": todo * score_s,
+        }
+        row["total_s"] = row["expand_s"] + row["embed_s"] + row["score_s"]
+
+        # Peak memory: model weights plus the largest stage
+        if analyzer.out_of_core:
+            held = analyzer.memory_budget_mb * 2**20
+        else:
+            embeddings = len(view) * config.hidden_size * 4
+            similarities = len(view) * n_expanded * 8
+            held = embeddings + similarities
+        records = sum(len(str(text)) for text in view.review_text) * 2
+        batch_size = max(
+            1,
+            min(embedder.batch_size, embedder.max_tokens // max(row["max_tokens"], 1)),
+        )
+        forward = activation_bytes(config, row["max_tokens"], batch_size)
+        row["peak_mb"] = (model_bytes + held + max(forward, records)) / 2**20
+        rows.append(row)
+
+    plan = pd.DataFrame(rows)
+    if shards:
+        assignment = split_shards(
+            dict(zip(plan["drug"], plan["total_s"] + 1e-9)), shards
+        )
+        shard_of = {drug: i for i, shard in enumerate(assignment) for drug in shard}
+        plan["shard"] = plan["drug"].map(shard_of)
+    return plan
+
+
+def format_plan(plan):
+    """
+    Render a cost table with a totals line.
+    :param plan: Output of plan_run.
+    :return: String.
+    """
+    table = plan.copy()
+    for col in ["expand_s", "embed_s", "score_s", "total_s"]:
+        table[col] = table[col].round(1)
+    table["peak_mb"] = plan["peak_mb"].round(1)
+    passes = plan[["expand_passes", "embed_passes", "score_passes"]].to_numpy().sum()
+    total = (
+        f"Total: {passes} forward passes, {plan['tokens'].sum()} comment tokens, "
+        f"{plan['total_s'].sum() / 3600:.2f} h, peak {plan['peak_mb'].max():,.1f} MB"
+    )
+    return table.to_string(index=False) + "\n" + total
@@ -0,0 +1,209 @@
+import time
+import numpy as np
+from scipy.sparse import csr_matrix
+
+
+def normalize(vectors):
+    """
+    Scale rows to unit length (zero rows are left unchanged).
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+class ProductQuantizer:
+    def __init__(self, n_subspaces=48, n_centroids=256, n_iter=20, seed=0):
+        """
+        Product quantization codec for unit-normalized embeddings. The vector is
+        split into n_subspaces chunks and each chunk is replaced by the index of its
+        nearest centroid, so a 768-dim float32 embedding (3072 bytes) becomes
+        n_subspaces uint8 codes. Cosine similarity to a query is then estimated
+        with asymmetric distance computation: per-subspace lookup tables of
+        query-centroid dot products, summed over the comment's codes.
+        :param n_subspaces: Number of subspaces (bytes per code); must divide
+                            the embedding dimension.
+        :param n_centroids: Centroids per subspace (at most 256 for uint8 codes).
+        :param n_iter: k-means iterations.
+        :param seed: Random seed.
+        """
+        self.n_subspaces = n_subspaces
+        self.n_centroids = n_centroids
+        self.n_iter = n_iter
+        self.seed = seed
+        self.codebooks = None  # (n_subspaces, n_centroids, sub_dim)
+
+    @property
+    def dim(self):
+        return self.codebooks.shape[0] * self.codebooks.shape[2]
+
+    def _split(self, vectors):
+        return vectors.reshape(len(vectors), self.n_subspaces, -1)
+
+    def fit(self, embeddings, max_train=50000):
+        """
+        Train one k-means codebook per subspace.
+        :param embeddings: Array of shape (n, dim), n >= n_centroids.
+        :param max_train: Maximum number of rows used for training.
+        :return: self.
+        """
+        rng = np.random.default_rng(self.seed)
+        vectors = np.asarray(embeddings)
+        if len(vectors) > max_train:
+            vectors = vectors[np.sort(rng.choice(len(vectors), max_train, False))]
+        if vectors.shape[1] % self.n_subspaces:
+            raise ValueError(
+                f"n_subspaces={self.n_subspaces} does not divide dim={vectors.shape[1]}"
+            )
+        if len(vectors) < self.n_centroids:
+            raise ValueError(
+                f"PQ training needs at least {self.n_centroids} embeddings, "
+                f"got {len(vectors)}"
+            )
+        chunks = self._split(normalize(vectors))
+        codebooks = []
+        for sub in range(self.n_subspaces):
+            x = chunks[:, sub]
+            centroids = x[rng.choice(len(x), self.n_centroids, replace=False)]
+            for _ in range(self.n_iter):
+                assign = self._nearest(x, centroids)
+                counts = np.bincount(assign, minlength=self.n_centroids)
+                members = csr_matrix(
+                    (np.ones(len(x), dtype=np.float32), (assign, np.arange(len(x)))),
+                    shape=(self.n_centroids, len(x)),
+                )
+                sums = members @ x
+                empty = counts == 0
+                centroids = sums / np.maximum(counts, 1)[:, None]
+                # Re-seed empty clusters with random training points
+                centroids[empty] = x[rng.choice(len(x), empty.sum())]
+            codebooks.append(centroids)
+        self.codebooks = np.stack(codebooks).astype(np.float32)
+        return self
+
+    @staticmethod
+    def _nearest(x, centroids):
+        distances = (centroids**2).sum(axis=1) - 2 * x @ centroids.T
+        return distances.argmin(axis=1)
+
+    def encode(self, embeddings, batch_size=10000):
+        """
+        Compress embeddings to PQ codes.
+        :param embeddings: Array-like of shape (n, dim), e.g. a np.memmap.
+        :param batch_size: Rows encoded at once.
+        :return: uint8 array of shape (n, n_subspaces).
+        """
+        codes = np.empty((len(embeddings), self.n_subspaces), dtype=np.uint8)
+        for start in range(0, len(embeddings), batch_size):
+            chunks = self._split(normalize(embeddings[start : start + batch_size]))
+            for sub in range(self.n_subspaces):
+                codes[start : start + len(chunks), sub] = self._nearest(
+                    chunks[:, sub], self.codebooks[sub]
+                )
+        return codes
+
+    def decode(self, codes):
+        """
+        Reconstruct approximate unit embeddings from PQ codes.
+        """
+        parts = [self.codebooks[sub][codes[:, sub]] for sub in range(self.n_subspaces)]
+        return np.concatenate(parts, axis=1)
+
+    def lookup_tables(self, queries):
+        """
+        Dot products between each query chunk and every centroid of its subspace.
+        :param queries: Array of shape (n_queries, dim).
+        :return: Array of shape (n_subspaces, n_centroids, n_queries).
+        """
+        chunks = self._split(normalize(queries))
+        return np.einsum("qsd,skd->skq", chunks, self.codebooks)
+
+    def onehot(self, codes):
+        """
+        Sparse one-hot matrix of PQ codes, with one nonzero per subspace, so that
+        asymmetric distance computation is a single sparse-dense product.
+        :param codes: uint8 array of shape (n, n_subspaces).
+        :return: CSR matrix of shape (n, n_subspaces * n_centroids).
+        """
+        n, m = codes.shape
+        columns = codes.astype(np.int32) + np.arange(m, dtype=np.int32) * (
+            self.n_centroids
+        )
+        return csr_matrix(
+            (
+                np.ones(n * m, dtype=np.float32),
+                columns.ravel(),
+                np.arange(0, n * m + 1, m),
+            ),
+            shape=(n, m * self.n_centroids),
+        )
+
+    def similarities(self, codes, queries):
+        """
+        Asymmetric distance computation: estimated cosine similarity between
+        every coded comment and every (uncompressed) query, reading only the
+        codes instead of the float embeddings.
+        :param codes: uint8 array of shape (n, n_subspaces), or its onehot matrix
+                      (reused across calls).
+        :param queries: Array of shape (n_queries, dim).
+        :return: float32 array of shape (n, n_queries).
+        """
+        if not isinstance(codes, csr_matrix):
+            codes = self.onehot(codes)
+        tables = self.lookup_tables(queries).reshape(-1, len(queries))
+        return np.asarray(codes @ tables, dtype=np.float32)
+
+    def save(self, path):
+        np.savez(
+            path,
+            codebooks=self.codebooks,
+            params=[self.n_subspaces, self.n_centroids, self.n_iter, self.seed],
+        )
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        pq = cls(*[int(value) for value in data["params"]])
+        pq.codebooks = data["codebooks"]
+        return pq
+
+
+def pq_report(pq, embeddings, queries, top_k=10, rerank_depth=50):
+    """
+    Compare PQ scoring with the exact float path on one set of embeddings.
+    :param pq: Trained ProductQuantizer.
+    :param embeddings: Array of shape (n, dim).
+    :param queries: Array of shape (n_queries, dim), e.g. keyword embeddings.
+    :param top_k: Size of the compared rankings.
+    :param rerank_depth: Number of PQ candidates rescored exactly.
+    :return: Dictionary with the compression ratio, the scoring speedup, the
+             mean top-k overlap with the exact ranking before and after the
+             exact rerank, and the mean absolute similarity error.
+    """
+    embeddings = normalize(embeddings)
+    queries = normalize(queries)
+    codes = pq.onehot(pq.encode(embeddings))
+
+    start = time.perf_counter()
+    exact = embeddings @ queries.T
+    exact_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    approx = pq.similarities(codes, queries)
+    pq_seconds = time.perf_counter() - start
+
+    k = min(top_k, len(embeddings))
+    depth = min(max(rerank_depth, k), len(embeddings))
+    overlap, reranked = [], []
+    for col in range(len(queries)):
+        true_top = set(np.argsort(-exact[:, col], kind="stable")[:k])
+        candidates = np.argsort(-approx[:, col], kind="stable")[:depth]
+        overlap.append(len(true_top & set(candidates[:k])) / k)
+        rerank = candidates[np.argsort(-exact[candidates, col], kind="stable")[:k]]
+        reranked.append(len(true_top & set(rerank)) / k)
+    return {
+        "compression_ratio": embeddings.itemsize * embeddings.shape[1] / pq.n_subspaces,
+        "speedup": exact_seconds / max(pq_seconds, 1e-9),
+        "top_k_agreement": float(np.mean(overlap)),
+        "top_k_agreement_reranked": float(np.mean(reranked)),
+        "mean_abs_error": float(np.abs(approx - exact).mean()),
+    }
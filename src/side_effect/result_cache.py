@@ -0,0 +1,160 @@
+import hashlib
+import json
+import logging
+import os
+from .file_utils import (
+    atomic_write,
+    atomic_write_json,
+    file_digest,
+    load_json,
+    json_default,
+)
+
+CACHE_DIR = "output/cache"
+
+
+class ResultCache:
+    def __init__(self, cache_dir=CACHE_DIR, max_size_mb=512):
+        """
+        On-disk cache of query results at (drug, side effect) granularity, so
+        that a query overlapping earlier ones only computes the missing pairs.
+        Each pair is one JSON file named by the hash of its key; an index keeps
+        entry sizes and use order for least-recently-used eviction, and the
+        content digest of every data file the entries were computed from.
+        :param cache_dir: Directory of the cache.
+        :param max_size_mb: Total size of the entries kept, in megabytes.
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size_mb * 2**20
+        self.index_path = os.path.join(cache_dir, "index.json")
+        index = load_json(self.index_path, {})
+        self.data_files = index.get("data_files", {})
+        # Entry name -> {"size", "last_used", "data_version"}
+        self.entries = index.get("entries", {})
+        self.clock = max([e["last_used"] for e in self.entries.values()] + [0])
+        self.hits = 0
+        self.misses = 0
+
+    def entry_path(self, name):
+        return os.path.join(self.cache_dir, "entries", f"{name}.json")
+
+    def data_version(self, data_path, digest=None):
+        """
+        Content digest of a data file. The digest is recomputed only when the
+        file's size or modification time changed; if the content changed, every
+        entry computed from the old content is dropped.
+        :param data_path: Path to the data file, e.g. data/reviews.csv.
+        :param digest: Digest of the data when the file computes its own, e.g.
+                       ReviewDatabase.data_version.
+        :return: Hex digest string.
+        """
+        stat = os.stat(data_path)
+        known = self.data_files.get(data_path)
+        if (
+            digest is None
+            and known
+            and [known["size"], known["mtime_ns"]]
+            == [
+                stat.st_size,
+                stat.st_mtime_ns,
+            ]
+        ):
+            return known["digest"]
+        if digest is None:
+            digest = file_digest(data_path)
+        if known and known["digest"] != digest:
+            stale = [
+                name
+                for name, entry in self.entries.items()
+                if entry["data_version"] == known["digest"]
+            ]
+            for name in stale:
+                self.remove(name)
+            logging.info(
+                f"{data_path} changed: invalidated {len(stale)} cached results"
+            )
+        self.data_files[data_path] = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "digest": digest,
+        }
+        self.save()
+        return digest
+
+    @staticmethod
+    def key(**parts):
+        """
+        Entry name of a set of key parts (any JSON-serializable values).
+        :return: Hex digest string.
+        """
+        text = json.dumps(parts, sort_keys=True, default=json_default)
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get(self, name):
+        """
+        Look up an entry and mark it as recently used.
+        :param name: Entry name from key.
+        :return: Cached value, or None on a miss.
+        """
+        value = load_json(self.entry_path(name)) if name in self.entries else None
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.clock += 1
+        self.entries[name]["last_used"] = self.clock
+        return value
+
+    def put(self, name, value, data_version):
+        """
+        Store an entry, then evict the least recently used entries until the
+        cache fits in its size budget.
+        :param name: Entry name from key.
+        :param value: JSON-serializable value (NumPy values are converted).
+        :param data_version: Digest of the data the value was computed from.
+        """
+        path = self.entry_path(name)
+        atomic_write(path, lambda f: json.dump(value, f, default=json_default))
+        self.clock += 1
+        self.entries[name] = {
+            "size": os.path.getsize(path),
+            "last_used": self.clock,
+            "data_version": data_version,
+        }
+        self.evict()
+
+    def evict(self):
+        total = sum(entry["size"] for entry in self.entries.values())
+        for name in sorted(self.entries, key=lambda n: self.entries[n]["last_used"]):
+            if total <= self.max_size:
+                break
+            total -= self.entries[name]["size"]
+            self.remove(name)
+
+    def remove(self, name):
+        self.entries.pop(name, None)
+        if os.path.exists(self.entry_path(name)):
+            os.remove(self.entry_path(name))
+
+    @property
+    def size(self):
+        return sum(entry["size"] for entry in self.entries.values())
+
+    def save(self):
+        """
+        Write the index (entry sizes, use order and data digests).
+        """
+        atomic_write_json(
+            {"data_files": self.data_files, "entries": self.entries}, self.index_path
+        )
+
+    def stats(self):
+        """
+        One-line summary of the cache hits and misses so far.
+        """
+        lookups = self.hits + self.misses
+        rate = self.hits / lookups if lookups else 0.0
+        return (
+            f"Result cache: {self.hits} hits, {self.misses} misses ({rate:.1%} hit "
+            f"rate), {len(self.entries)} entries, {self.size / 2**20:.1f} MB"
+        )
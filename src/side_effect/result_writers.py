@@ -0,0 +1,178 @@
+import json
+import os
+from abc import ABC, abstractmethod
+from collections import namedtuple
+import pandas as pd
+from .file_utils import json_default
+
+# Results of one drug: annotated comment rows, side effect scores, top comments and,
+# for sampled scores, their (lower, upper) confidence intervals
+DrugResult = namedtuple(
+    "DrugResult",
+    ["drug", "comments", "scores", "top_k_comments", "intervals"],
+    defaults=(None,),
+)
+
+TABLES = ("new_comment_dict", "side_effect_scores", "top_k_comments")
+
+
+def result_tables(result):
+    """
+    Split a DrugResult into the rows of the three output tables.
+    :param result: DrugResult.
+    :return: Dictionary mapping table name to a list of row dictionaries.
+    """
+    scores = [
+        {"drug": result.drug, "side_effect": side_effect, "score": score}
+        for side_effect, score in result.scores.items()
+    ]
+    if result.intervals is not None:
+        for row in scores:
+            row["ci_lower"], row["ci_upper"] = result.intervals[row["side_effect"]]
+    return {
+        "new_comment_dict": result.comments,
+        "side_effect_scores": scores,
+        "top_k_comments": result.top_k_comments,
+    }
+
+
+class ResultWriter(ABC):
+    extension = None
+
+    def __init__(self, output_dir):
+        """
+        Appends per-drug results to the output tables as soon as they are ready.
+        :param output_dir: Directory of the output files.
+        """
+        self.output_dir = output_dir
+        self.started = set()
+        # Table -> columns of its first rows, which fix the file's header/schema
+        self.columns = {}
+        os.makedirs(output_dir, exist_ok=True)
+
+    def path(self, table):
+        return os.path.join(self.output_dir, f"{table}.{self.extension}")
+
+    def write(self, result):
+        """
+        Append one drug's results to every output table.
+        :param result: DrugResult.
+        """
+        for table, rows in result_tables(result).items():
+            if rows:
+                self.append(table, rows, first=table not in self.started)
+                self.started.add(table)
+
+    def frame(self, table, rows):
+        """
+        Rows as a DataFrame with the columns of the table's first rows, in the
+        same order; columns missing from later rows are left empty.
+        :raises ValueError: If the rows have a column the first rows did not have.
+        """
+        data = pd.DataFrame(rows)
+        columns = self.columns.setdefault(table, list(data.columns))
+        extra = [col for col in data.columns if col not in columns]
+        if extra:
+            raise ValueError(
+                f"Columns {extra} of {table} are not in its first rows' columns "
+                f"{columns}"
+            )
+        return data.reindex(columns=columns)
+
+    @abstractmethod
+    def append(self, table, rows, first):
+        """
+        Append rows to one output table.
+        :param table: Table name, one of TABLES.
+        :param rows: List of row dictionaries.
+        :param first: Whether these are the table's first rows in this run.
+        """
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CSVResultWriter(ResultWriter):
+    extension = "csv"
+
+    def append(self, table, rows, first):
+        self.frame(table, rows).to_csv(
+            self.path(table), mode="w" if first else "a", header=first, index=False
+        )
+
+
+class JSONResultWriter(ResultWriter):
+    extension = "jsonl"
+
+    def append(self, table, rows, first):
+        with open(self.path(table), "w" if first else "a", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row, default=json_default) + "\n")
+
+
+class ParquetResultWriter(ResultWriter):
+    extension = "parquet"
+
+    def __init__(self, output_dir):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ImportError("Parquet output requires the pyarrow package")
+        super().__init__(output_dir)
+        self.writers = {}
+
+    def append(self, table, rows, first):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        data = self.frame(table, rows)
+        if first:
+            data = pa.Table.from_pandas(data, preserve_index=False)
+            self.writers[table] = pq.ParquetWriter(self.path(table), data.schema)
+        else:
+            data = pa.Table.from_pandas(
+                data, schema=self.writers[table].schema, preserve_index=False
+            )
+        self.writers[table].write_table(data)
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+        self.writers = {}
+
+
+WRITERS = {
+    "csv": CSVResultWriter,
+    "json": JSONResultWriter,
+    "parquet": ParquetResultWriter,
+}
+
+
+def get_writer(output_format, output_dir):
+    """
+    Create the incremental writer for an output format.
+    :param output_format: One of 'csv', 'json' or 'parquet'.
+    :param output_dir: Directory of the output files.
+    :return: ResultWriter instance.
+    """
+    if output_format not in WRITERS:
+        raise ValueError(f"Unknown output format: {output_format}")
+    return WRITERS[output_format](output_dir)
+
+
+def summarize_result(result, k=3):
+    """
+    One-line console summary of a drug's results.
+    :param result: DrugResult.
+    :param k: Number of top side effects shown.
+    :return: Summary string.
+    """
+    top = sorted(result.scores.items(), key=lambda x: x[1], reverse=True)[:k]
+    top = ", ".join(f"{side_effect} ({score:.3f})" for side_effect, score in top)
+    return f"{result.drug}: {len(result.comments)} comments, top side effects: {top}"
@@ -0,0 +1,279 @@
+import hashlib
+import os
+import sqlite3
+import numpy as np
+import pandas as pd
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reviews (
+    review_id INTEGER PRIMARY KEY,
+    drug TEXT NOT NULL,
+    review_text TEXT,
+    cleaned_comments TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_reviews_drug ON reviews (drug);
+CREATE TABLE IF NOT EXISTS embeddings (
+    review_id INTEGER NOT NULL,
+    model TEXT NOT NULL,
+    vector BLOB NOT NULL,
+    PRIMARY KEY (review_id, model)
+);
+CREATE TABLE IF NOT EXISTS scores (
+    drug TEXT NOT NULL,
+    side_effect TEXT NOT NULL,
+    model TEXT NOT NULL,
+    score REAL,
+    PRIMARY KEY (drug, side_effect, model)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS reviews_fts USING fts5(
+    cleaned_comments, content='reviews', content_rowid='review_id'
+);
+"""
+
+
+def hash_rows(df):
+    """
+    Bytes identifying the values of a DataFrame's rows, for incremental digests.
+    """
+    return pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes()
+
+
+class ReviewDatabase:
+    def __init__(self, path):
+        """
+        Local SQLite store of cleaned reviews, indexed by drug with a full-text
+        index on cleaned_comments, plus caches of embeddings and side effect scores.
+        :param path: Path to the SQLite database file.
+        """
+        self.path = path
+        self._conn = None
+        self._pid = None
+        self.conn.executescript(SCHEMA)
+        try:
+            self.conn.executescript(FTS_SCHEMA)
+            self.has_fts = True
+        except sqlite3.OperationalError:  # SQLite built without FTS5
+            self.has_fts = False
+
+    @property
+    def conn(self):
+        """
+        Connection of the current process; forked workers open their own.
+        """
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path)
+            self._pid = os.getpid()
+        return self._conn
+
+    def close(self):
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None
+
+    def build(self, data, chunk_size=50000):
+        """
+        Replace the stored reviews with the output of prepare_data, inserting rows
+        in bulk inside a single transaction. Cached embeddings and scores are
+        cleared since review ids change.
+        :param data: Pandas DataFrame (or path to its CSV) with 'Drug Name',
+                     'Review Text' and 'cleaned_comments' columns.
+        :param chunk_size: Number of rows inserted per executemany call.
+        """
+        if isinstance(data, str):
+            data = pd.read_csv(data)
+        columns = data[["Drug Name", "Review Text", "cleaned_comments"]]
+        digest = hashlib.sha256()
+        with self.conn:
+            self.conn.execute("DELETE FROM reviews")
+            self.conn.execute("DELETE FROM embeddings")
+            self.conn.execute("DELETE FROM scores")
+            for start in range(0, len(columns), chunk_size):
+                chunk = columns.iloc[start : start + chunk_size]
+                self.conn.executemany(
+                    "INSERT INTO reviews (drug, review_text, cleaned_comments) "
+                    "VALUES (?, ?, ?)",
+                    chunk.itertuples(index=False, name=None),
+                )
+                digest.update(hash_rows(chunk))
+            self.set_meta("data_version", digest.hexdigest())
+            if self.has_fts:
+                self.conn.execute(
+                    "INSERT INTO reviews_fts (reviews_fts) VALUES ('rebuild')"
+                )
+
+    def set_meta(self, key, value):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value)
+        )
+
+    def data_version(self, chunk_size=50000):
+        """
+        Digest of the stored reviews, recorded by build. The file itself also
+        holds the embedding and score caches, so its bytes change between runs
+        while the reviews do not. Databases built before the digest was recorded
+        are hashed once and the digest is stored.
+        :return: Hex digest string.
+        """
+        row = self.conn.execute(
+            "SELECT value FROM meta WHERE key = 'data_version'"
+        ).fetchone()
+        if row is not None:
+            return row[0]
+        digest = hashlib.sha256()
+        for chunk in pd.read_sql_query(
+            "SELECT drug, review_text, cleaned_comments FROM reviews "
+            "ORDER BY review_id",
+            self.conn,
+            chunksize=chunk_size,
+        ):
+            digest.update(hash_rows(chunk))
+        with self.conn:
+            self.set_meta("data_version", digest.hexdigest())
+        return digest.hexdigest()
+
+    def drugs(self):
+        """
+        Distinct drug names, read from the drug index.
+        :return: NumPy array of drug names.
+        """
+        rows = self.conn.execute("SELECT DISTINCT drug FROM reviews ORDER BY drug")
+        return np.array([drug for (drug,) in rows], dtype=object)
+
+    def drug_counts(self):
+        """
+        Number of reviews per drug.
+        :return: Dictionary mapping drug name to review count.
+        """
+        rows = self.conn.execute("SELECT drug, COUNT(*) FROM reviews GROUP BY drug")
+        return dict(rows.fetchall())
+
+    def load_reviews(self, drugs=None):
+        """
+        Load the reviews of selected drugs only.
+        :param drugs: List of drug names, or None for all reviews.
+        :return: Pandas DataFrame with 'review_id', 'Drug Name', 'Review Text' and
+                 'cleaned_comments' columns.
+        """
+        query = (
+            "SELECT review_id, drug AS 'Drug Name', review_text AS 'Review Text', "
+            "cleaned_comments FROM reviews"
+        )
+        params = []
+        if drugs is not None:
+            drugs = list(drugs)
+            query += f" WHERE drug IN ({','.join('?' * len(drugs))})"
+            params = drugs
+        return pd.read_sql_query(
+            query + " ORDER BY review_id", self.conn, params=params
+        )
+
+    def search(self, query, drug=None):
+        """
+        Full-text search over cleaned comments.
+        :param query: FTS5 query, e.g. 'nausea OR vomiting'.
+        :param drug: Optional drug name restricting the search.
+        :return: NumPy array of matching review ids.
+        """
+        if not self.has_fts:
+            raise RuntimeError("SQLite was built without FTS5 support")
+        sql = (
+            "SELECT reviews.review_id FROM reviews_fts "
+            "JOIN reviews ON reviews.review_id = reviews_fts.rowid "
+            "WHERE reviews_fts MATCH ?"
+        )
+        params = [query]
+        if drug is not None:
+            sql += " AND reviews.drug = ?"
+            params.append(drug)
+        rows = self.conn.execute(sql + " ORDER BY reviews.review_id", params)
+        return np.fromiter((review_id for (review_id,) in rows), dtype=np.int64)
+
+    def save_embeddings(self, review_ids, embeddings, model):
+        """
+        Cache comment embeddings as float32 blobs in one transaction.
+        :param review_ids: Array of review ids.
+        :param embeddings: Array of shape (len(review_ids), dim).
+        :param model: Name of the model that produced the embeddings.
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (review_id, model, vector) "
+                "VALUES (?, ?, ?)",
+                (
+                    (int(review_id), model, vector.tobytes())
+                    for review_id, vector in zip(review_ids, embeddings)
+                ),
+            )
+
+    def load_embeddings(self, review_ids, model):
+        """
+        Read cached embeddings.
+        :param review_ids: Array of review ids.
+        :param model: Name of the model that produced the embeddings.
+        :return: Tuple (ids found, float32 array of their embeddings).
+        """
+        found, vectors = [], []
+        review_ids = [int(review_id) for review_id in review_ids]
+        for start in range(0, len(review_ids), 900):  # SQLite variable limit
+            chunk = review_ids[start : start + 900]
+            rows = self.conn.execute(
+                "SELECT review_id, vector FROM embeddings WHERE model = ? "
+                f"AND review_id IN ({','.join('?' * len(chunk))})",
+                [model, *chunk],
+            )
+            for review_id, vector in rows:
+                found.append(review_id)
+                vectors.append(np.frombuffer(vector, dtype=np.float32))
+        if not vectors:
+            return np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=np.float32)
+        return np.array(found, dtype=np.int64), np.vstack(vectors)
+
+    def embedded_ids(self, model):
+        """
+        Ids of the reviews whose embedding is cached for a model.
+        :param model: Name of the model.
+        :return: Sorted NumPy array of review ids.
+        """
+        rows = self.conn.execute(
+            "SELECT review_id FROM embeddings WHERE model = ? ORDER BY review_id",
+            (model,),
+        )
+        return np.fromiter((review_id for (review_id,) in rows), dtype=np.int64)
+
+    def save_scores(self, drug, side_effect_scores, model):
+        """
+        Store the side effect scores of a drug in one transaction.
+        :param drug: Drug name.
+        :param side_effect_scores: Dictionary mapping side effect to score.
+        :param model: Name of the model used for scoring.
+        """
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO scores (drug, side_effect, model, score) "
+                "VALUES (?, ?, ?, ?)",
+                (
+                    (drug, side_effect, model, float(score))
+                    for side_effect, score in side_effect_scores.items()
+                ),
+            )
+
+    def load_scores(self, drug, model):
+        """
+        Read the stored side effect scores of a drug.
+        :return: Tuple (array of side effects, array of scores).
+        """
+        rows = self.conn.execute(
+            "SELECT side_effect, score FROM scores WHERE drug = ? AND model = ? "
+            "ORDER BY side_effect",
+            (drug, model),
+        ).fetchall()
+        side_effects = np.array([side_effect for side_effect, _ in rows], dtype=object)
+        return side_effects, np.array([score for _, score in rows], dtype=np.float64)
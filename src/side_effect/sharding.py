@@ -0,0 +1,254 @@
+import glob
+import logging
+import multiprocessing
+import os
+import socket
+import time
+import torch
+from .file_utils import atomic_write_json, load_json
+
+
+def split_shards(comment_counts, n_shards):
+    """
+    Split drugs into shards of roughly equal work, assigning the largest drugs
+    first to the currently lightest shard.
+    :param comment_counts: Dictionary mapping drug name to its number of comments.
+    :param n_shards: Number of shards.
+    :return: List of non-empty lists of drug names.
+    """
+    shards = [[] for _ in range(n_shards)]
+    loads = [0] * n_shards
+    for drug, count in sorted(comment_counts.items(), key=lambda x: (-x[1], x[0])):
+        lightest = loads.index(min(loads))
+        shards[lightest].append(drug)
+        loads[lightest] += count
+    return [shard for shard in shards if shard]
+
+
+def queue_dirs(queue_dir):
+    """
+    Paths of the todo, claimed and done folders of a work queue.
+    """
+    return {
+        state: os.path.join(queue_dir, state) for state in ("todo", "claimed", "done")
+    }
+
+
+def enqueue_shards(queue_dir, shards, initial_keywords):
+    """
+    Write one task file per shard into the queue's todo folder, and the run's
+    full drug list to run.json so workers can load all their data once.
+    :param queue_dir: Work queue directory, on a filesystem shared by all workers.
+    :param shards: List of lists of drug names.
+    :param initial_keywords: List of side effects to score.
+    """
+    for path in queue_dirs(queue_dir).values():
+        os.makedirs(path, exist_ok=True)
+    atomic_write_json(
+        {
+            "drugs": [drug for shard in shards for drug in shard],
+            "side_effects": list(initial_keywords),
+        },
+        os.path.join(queue_dir, "run.json"),
+    )
+    for i, shard in enumerate(shards):
+        atomic_write_json(
+            {"drugs": shard, "side_effects": list(initial_keywords)},
+            os.path.join(queue_dirs(queue_dir)["todo"], f"shard_{i:05d}.json"),
+        )
+
+
+def claim_task(queue_dir):
+    """
+    Claim the next task. Claiming is an atomic rename, so concurrent workers on
+    one or several machines never process the same task twice. The claimed
+    file's modification time is the claim's heartbeat (see touch_claim).
+    :param queue_dir: Work queue directory.
+    :return: Tuple (claimed task path, task dictionary), or None if no task is left.
+    """
+    dirs = queue_dirs(queue_dir)
+    worker = f"{socket.gethostname()}-{os.getpid()}"
+    for todo_path in sorted(glob.glob(os.path.join(dirs["todo"], "*.json"))):
+        claimed_path = os.path.join(
+            dirs["claimed"], f"{worker}--{os.path.basename(todo_path)}"
+        )
+        try:
+            os.rename(todo_path, claimed_path)
+        except FileNotFoundError:
+            continue  # claimed by another worker
+        # A rename keeps the enqueue time, which would make the claim look stale
+        touch_claim(claimed_path)
+        return claimed_path, load_json(claimed_path)
+    return None
+
+
+def touch_claim(claimed_path):
+    """
+    Refresh a claim's heartbeat so requeue_stale does not take it back while
+    its task is still running.
+    :param claimed_path: Claimed task path from claim_task.
+    :return: False if the claim was already requeued, True otherwise.
+    """
+    try:
+        os.utime(claimed_path)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def complete_task(queue_dir, claimed_path):
+    """
+    Move a claimed task to the queue's done folder. A claim that was requeued
+    meanwhile is left to the worker that claims it next; its finished drugs
+    are checkpointed and will not be recomputed.
+    :return: False if the claim was already requeued, True otherwise.
+    """
+    task_name = os.path.basename(claimed_path).split("--", 1)[1]
+    try:
+        os.rename(claimed_path, os.path.join(queue_dirs(queue_dir)["done"], task_name))
+    except FileNotFoundError:
+        logging.warning(f"Claim {claimed_path} was requeued before it completed")
+        return False
+    return True
+
+
+def requeue_stale(queue_dir, timeout=6 * 3600, worker=None):
+    """
+    Move tasks whose claim heartbeat is older than a timeout (e.g. claimed by a
+    crashed machine) back to the todo folder. Finished drugs are not recomputed thanks to checkpoints.
+    :param queue_dir: Work queue directory.
+    :param timeout: Seconds without a heartbeat after which a claim is
+                    considered stale.
+    :param worker: If given, requeue every task claimed by this worker id
+                   ("<host>-<pid>") regardless of age.
+    :return: Number of requeued tasks.
+    """
+    dirs = queue_dirs(queue_dir)
+    requeued = 0
+    for claimed_path in glob.glob(os.path.join(dirs["claimed"], "*.json")):
+        claimed_by = os.path.basename(claimed_path).split("--", 1)[0]
+        if claimed_by == worker or (
+            time.time() - os.path.getmtime(claimed_path) > timeout
+        ):
+            task_name = os.path.basename(claimed_path).split("--", 1)[1]
+            try:
+                os.rename(claimed_path, os.path.join(dirs["todo"], task_name))
+                requeued += 1
+            except FileNotFoundError:
+                continue
+    return requeued
+
+
+def queue_pending(queue_dir):
+    """
+    Number of tasks still waiting or in progress.
+    """
+    dirs = queue_dirs(queue_dir)
+    return len(glob.glob(os.path.join(dirs["todo"], "*.json"))) + len(
+        glob.glob(os.path.join(dirs["claimed"], "*.json"))
+    )
+
+
+def work_queue(analyzer, file_path, run_dir, threads=None):
+    """
+    Process tasks from the run's work queue until it is empty. The reviews of
+    the run are loaded and preprocessed once, at the first claimed task, and
+    every task's drugs are scored against that store. Each finished drug
+    is checkpointed in run_dir by SideEffectAnalyzer.iter_results; a requeued
+    task skips the drugs already checkpointed in the same run_dir, so each new
+    sharded run gets its own run_dir.
+    :param analyzer: SideEffectAnalyzer with its model already loaded.
+    :param file_path: Path to the reviews CSV file.
+    :param run_dir: Run directory holding the queue and the checkpoints.
+    :param threads: Number of torch intra-op threads used by this worker.
+    :return: Number of tasks processed.
+    """
+    if threads:
+        torch.set_num_threads(threads)
+    # The result cache index is written by a single process; workers only
+    # checkpoint
+    analyzer.result_cache = None
+    queue_dir = os.path.join(run_dir, "queue")
+    run = load_json(os.path.join(queue_dir, "run.json"))
+    comment_store = None
+    n_tasks = 0
+    while True:
+        claimed = claim_task(queue_dir)
+        if claimed is None:
+            return n_tasks
+        claimed_path, task = claimed
+        if comment_store is None and run is not None:
+            comment_store = analyzer.prepare_store(file_path, run["drugs"])
+        logging.info(f"Worker {os.getpid()} processing shard {task['drugs']}")
+        for _ in analyzer.iter_results(
+            file_path,
+            task["drugs"],
+            task["side_effects"],
+            run_dir=run_dir,
+            resume=True,
+            comment_store=comment_store,
+        ):
+            # Results are kept in the checkpoints only; each finished drug
+            # refreshes the claim's heartbeat
+            touch_claim(claimed_path)
+        complete_task(queue_dir, claimed_path)
+        n_tasks += 1
+
+
+def run_sharded(
+    analyzer,
+    file_path,
+    comment_counts,
+    initial_keywords,
+    run_dir,
+    n_workers=2,
+    threads_per_worker=None,
+    poll_interval=10,
+):
+    """
+    Process drugs on a pool of forked worker processes fed by a work queue in
+    run_dir. Workers are forked after the model is loaded, so they share its
+    read-only weight pages instead of loading their own copy. Other machines can
+    join the same run with work_queue on the shared run_dir.
+    :param analyzer: SideEffectAnalyzer with its model already loaded.
+    :param file_path: Path to the reviews CSV file.
+    :param comment_counts: Dictionary mapping each drug to process to its
+                           number of comments, used to balance shards.
+    :param initial_keywords: List of side effects to score.
+    :param run_dir: Run directory holding the queue and the checkpoints.
+    :param n_workers: Number of local worker processes.
+    :param threads_per_worker: Torch threads per worker; defaults to an even split
+                               of the CPU cores.
+    :param poll_interval: Seconds between checks for tasks held by other machines.
+    """
+    queue_dir = os.path.join(run_dir, "queue")
+    if queue_pending(queue_dir) == 0:
+        shards = split_shards(comment_counts, n_workers * 4)
+        enqueue_shards(queue_dir, shards, initial_keywords)
+        logging.info(f"Enqueued {len(shards)} shards in {queue_dir}")
+    else:
+        logging.info(f"Requeued {requeue_stale(queue_dir)} stale shards")
+
+    if threads_per_worker is None:
+        threads_per_worker = max(1, (os.cpu_count() or 1) // n_workers)
+    context = multiprocessing.get_context("fork")
+    workers = [
+        context.Process(
+            target=work_queue,
+            args=(analyzer, file_path, run_dir, threads_per_worker),
+        )
+        for _ in range(n_workers)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+        if worker.exitcode != 0:
+            logging.warning(f"Worker {worker.pid} exited with code {worker.exitcode}")
+            requeue_stale(queue_dir, worker=f"{socket.gethostname()}-{worker.pid}")
+
+    # Wait for shards claimed by workers on other machines, taking over stale ones
+    while queue_pending(queue_dir) > 0:
+        requeue_stale(queue_dir)
+        if work_queue(analyzer, file_path, run_dir) == 0:
+            time.sleep(poll_interval)
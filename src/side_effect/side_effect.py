@@ -1,10 +1,17 @@
 import re
 import ssl
+import numpy as np
 import pandas as pd
 from nltk.corpus import wordnet
 import nltk
 import os
+import pickle
+from concurrent.futures import ThreadPoolExecutor
 from nltk.sentiment import SentimentIntensityAnalyzer
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from .file_utils import atomic_write
+from .comment_store import CommentStore
 
 ssl._create_default_https_context = ssl._create_unverified_context
 
@@ -50,35 +57,111 @@ def get_comment_dict(df, comment_col_name=None, cleaned_data=False):
     return dict
 
 
+def get_comment_store(df, comment_col_name, lim):
+    """
+    Cleans comments and builds a columnar CommentStore of the comments longer
+    than a word limit, indexed by drug.
+    :param df: Pandas DataFrame containing comments.
+    :param comment_col_name: Column name for the comments.
+    :param lim: Comments with at most this many words are dropped.
+    :return: CommentStore.
+    """
+    cleaned_comments = [preprocess_text(comment) for comment in df[comment_col_name]]
+    df = df.assign(cleaned_comments=cleaned_comments)
+    df = df[df["cleaned_comments"].str.split().str.len() > lim]
+    return CommentStore(df)
+
+
 def pick_drug(comment_dict, drug_name):
     """
     Filters comments and metadata for a specific drug.
-    :param comment_dict: List of comment dictionaries.
+    :param comment_dict: List of comment dictionaries, or a CommentStore.
     :param drug_name: Name of the drug to filter comments for.
     :return: List of comments and cleaned comment texts for the specified drug.
+             For a CommentStore, a DrugView and an array of cleaned texts, both
+             views into the store.
     """
+    if isinstance(comment_dict, CommentStore):
+        drug_view = comment_dict.drug(drug_name)
+        return drug_view, drug_view.comments
     drug_dict = [item for item in comment_dict if item["Drug Name"] == drug_name]
     drug_comment = [item["cleaned_comments"] for item in drug_dict]
     return drug_dict, drug_comment
 
 
-def merge_data(folder_path):
+MERGE_SCHEMA = {
+    "Drug Name": str,
+    "Review Text": str,
+    "cleaned_comments": str,
+    "side_effects": str,
+}
+MERGE_CACHE_NAME = ".merged_cache.pkl"
+
+
+def _csv_engine():
+    """
+    Return the fastest available pandas CSV engine (pyarrow if installed).
+    """
+    try:
+        import pyarrow  # noqa: F401
+
+        return "pyarrow"
+    except ImportError:
+        return "c"
+
+
+def _read_schema_csv(file_path, engine):
+    """
+    Read one CSV file using the explicit merge schema.
+    """
+    return pd.read_csv(file_path, dtype=MERGE_SCHEMA, engine=engine)
+
+
+def merge_data(folder_path, n_workers=8, use_cache=True):
     """
     Merge all CSV files in a specified folder into a single DataFrame.
 
+    Files are read concurrently with an explicit string schema, 'Drug Name' is
+    stored as a categorical column, and the merged result is cached in the folder,
+    keyed by the file names, sizes and modification times.
+
     Parameters:
     folder_path (str): Path to the folder containing the CSV files.
+    n_workers (int): Number of threads used to read files.
+    use_cache (bool): Whether to reuse or refresh the cached merged result.
 
     Returns:
     pd.DataFrame: A DataFrame that combines all CSV files in the folder.
     """
-    merged_files = []
-    for file_name in os.listdir(folder_path):
-        if file_name.endswith(".csv"):
-            file_path = os.path.join(folder_path, file_name)
-            df = pd.read_csv(file_path)
-            merged_files.append(df)
+    file_names = sorted(
+        file_name for file_name in os.listdir(folder_path) if file_name.endswith(".csv")
+    )
+    file_paths = [os.path.join(folder_path, file_name) for file_name in file_names]
+    cache_key = []
+    for file_name, file_path in zip(file_names, file_paths):
+        stat = os.stat(file_path)
+        cache_key.append((file_name, stat.st_size, stat.st_mtime_ns))
+
+    cache_path = os.path.join(folder_path, MERGE_CACHE_NAME)
+    if use_cache and os.path.exists(cache_path):
+        cached = pd.read_pickle(cache_path)
+        if cached["key"] == cache_key:
+            return cached["data"]
+
+    engine = _csv_engine()
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        merged_files = list(
+            executor.map(lambda path: _read_schema_csv(path, engine), file_paths)
+        )
     merged_df = pd.concat(merged_files, ignore_index=True)
+    merged_df["Drug Name"] = merged_df["Drug Name"].astype("category")
+
+    if use_cache:
+        atomic_write(
+            cache_path,
+            lambda f: pickle.dump({"key": cache_key, "data": merged_df}, f),
+            mode="wb",
+        )
     return merged_df
 
 
@@ -98,6 +181,143 @@ def remove_comment(dict, lim):
     return rm_sc
 
 
+def minhash_signatures(texts, num_perm=64, shingle_size=3, seed=0, batch_size=500):
+    """
+    Compute MinHash signatures of word shingles for a list of texts.
+    Shingles are encoded as integers with pandas factorize and hashed with
+    vectorized multiply-shift hashing, processed in batches of documents.
+    :param texts: Iterable of (cleaned) texts.
+    :param num_perm: Number of hash permutations (signature length).
+    :param shingle_size: Number of consecutive words in a shingle.
+    :param seed: Random seed for the hash permutations.
+    :param batch_size: Number of documents hashed at once.
+    :return: NumPy array of shape (n_texts, num_perm).
+    """
+    texts = pd.Series(list(texts), dtype=object).fillna("")
+    words = texts.str.split().explode()
+    doc = words.index.to_numpy()
+    word_ids = pd.factorize(words)[0] + 1  # empty documents get id 0
+    vocab_size = word_ids.max() + 2  # last id marks "past the end of document"
+
+    # Position of each word within its document
+    doc_len = np.bincount(doc, minlength=len(texts))
+    doc_start = np.concatenate([[0], np.cumsum(doc_len)[:-1]])
+    pos = np.arange(len(doc)) - doc_start[doc]
+
+    # Combine consecutive word ids into a single shingle id
+    shingle = word_ids.astype(np.int64)
+    for k in range(1, shingle_size):
+        following = np.full(len(doc), vocab_size - 1, dtype=np.int64)
+        following[:-k] = np.where(doc[k:] == doc[:-k], word_ids[k:], vocab_size - 1)
+        shingle = pd.factorize(shingle * vocab_size + following)[0].astype(np.int64)
+
+    # Keep full shingles, or the whole text for documents shorter than a shingle
+    keep = (pos + shingle_size <= doc_len[doc]) | (
+        (doc_len[doc] < shingle_size) & (pos == 0)
+    )
+    doc, shingle = doc[keep], shingle[keep].astype(np.uint64)
+
+    # h(x) = ((a * x + b) mod 2**64) >> 32 with odd multipliers a
+    rng = np.random.default_rng(seed)
+    a = rng.integers(0, 2**64, size=num_perm, dtype=np.uint64) | np.uint64(1)
+    b = rng.integers(0, 2**64, size=num_perm, dtype=np.uint64)
+    row_start = np.searchsorted(doc, np.arange(len(texts)))
+
+    signatures = np.empty((len(texts), num_perm), dtype=np.uint32)
+    for begin in range(0, len(texts), batch_size):
+        end = min(begin + batch_size, len(texts))
+        lo = row_start[begin]
+        hi = row_start[end] if end < len(texts) else len(doc)
+        # Permutations along the first axis keep the per-document reduction contiguous
+        hashed = (a[:, None] * shingle[None, lo:hi] + b[:, None]) >> np.uint64(32)
+        signatures[begin:end] = np.minimum.reduceat(
+            hashed, row_start[begin:end] - lo, axis=1
+        ).T
+    return signatures
+
+
+def lsh_params(threshold, num_perm):
+    """
+    Choose the number of LSH bands and rows per band whose S-curve midpoint,
+    (1 / bands) ** (1 / rows), is closest to the Jaccard threshold.
+    :param threshold: Jaccard similarity threshold.
+    :param num_perm: Signature length.
+    :return: Tuple (bands, rows).
+    """
+    candidates = [
+        (bands, num_perm // bands)
+        for bands in range(1, num_perm + 1)
+        if num_perm // bands > 0
+    ]
+    return min(
+        candidates,
+        key=lambda br: abs((1 / br[0]) ** (1 / br[1]) - threshold),
+    )
+
+
+def near_duplicate_clusters(signatures, groups, threshold=0.8):
+    """
+    Cluster near-duplicate documents with MinHash LSH.
+    Documents sharing an LSH bucket (within the same group) are linked to the
+    first document of the bucket when their estimated Jaccard similarity
+    reaches the threshold; clusters are the connected components of those links.
+    :param signatures: MinHash signatures of shape (n_docs, num_perm).
+    :param groups: Integer group code per document; only documents of the same
+                   group can be duplicates.
+    :param threshold: Jaccard similarity threshold.
+    :return: NumPy array with a cluster label per document.
+    """
+    n_docs, num_perm = signatures.shape
+    bands, rows = lsh_params(threshold, num_perm)
+    doc_ids = np.arange(n_docs)
+    src, dst = [], []
+    for band in range(bands):
+        block = signatures[:, band * rows : (band + 1) * rows]
+        keys = np.column_stack([np.asarray(groups, dtype=np.uint64), block])
+        _, first, inverse = np.unique(
+            keys, axis=0, return_index=True, return_inverse=True
+        )
+        leader = first[inverse.ravel()]
+        candidate = leader != doc_ids
+        i, j = doc_ids[candidate], leader[candidate]
+        similar = (signatures[i] == signatures[j]).mean(axis=1) >= threshold
+        src.append(i[similar])
+        dst.append(j[similar])
+    src, dst = np.concatenate(src), np.concatenate(dst)
+    graph = coo_matrix((np.ones(len(src)), (src, dst)), shape=(n_docs, n_docs))
+    return connected_components(graph, directed=False)[1]
+
+
+def remove_near_duplicates(
+    df, comment_col="cleaned_comments", group_col="Drug Name", threshold=0.8, **kwargs
+):
+    """
+    Remove near-duplicate comments (reposts, quoted replies, cross-posted titles)
+    within each drug, keeping the first comment of every cluster.
+
+    Parameters:
+    df (pd.DataFrame): A DataFrame containing comment and drug columns.
+    comment_col (str): Column holding the texts to compare.
+    group_col (str): Column restricting duplicates to the same group.
+    threshold (float): Jaccard similarity threshold on word shingles.
+    kwargs: Extra arguments passed to minhash_signatures.
+
+    Returns:
+    pd.DataFrame: Deduplicated DataFrame with a 'duplicate_count' column holding
+    the size of the cluster each kept comment represents.
+    """
+    if len(df) == 0:
+        return df.assign(duplicate_count=pd.Series(dtype=int))
+    signatures = minhash_signatures(df[comment_col], **kwargs)
+    groups = pd.factorize(df[group_col])[0]
+    labels = near_duplicate_clusters(signatures, groups, threshold)
+    _, first = np.unique(labels, return_index=True)
+    first = np.sort(first)
+    deduplicated = df.iloc[first].copy()
+    deduplicated["duplicate_count"] = np.bincount(labels)[labels[first]]
+    return deduplicated
+
+
 def remove_positive_comments(df):
     """
     Remove rows from a DataFrame where the sentiment score of the 'Review Text' column is positive.
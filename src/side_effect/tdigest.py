@@ -0,0 +1,88 @@
+import numpy as np
+
+
+class TDigest:
+    def __init__(self, compression=200):
+        """
+        Mergeable streaming quantile sketch (t-digest with the arcsine scale
+        function). At most about compression / 2 centroids are kept, so memory is
+        bounded regardless of the number of values; the rank error of a quantile
+        estimate is roughly 1 / compression, smallest near the tails.
+        :param compression: Accuracy / size trade-off (delta).
+        """
+        self.compression = compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.min = np.inf
+        self.max = -np.inf
+
+    @property
+    def count(self):
+        return self.weights.sum()
+
+    def _scale(self, q):
+        return self.compression / (2 * np.pi) * np.arcsin(2 * np.clip(q, 0, 1) - 1)
+
+    def _compress(self, means, weights):
+        """
+        Merge sorted-by-mean centroids so that each cluster spans at most one unit
+        of the scale function.
+        """
+        order = np.argsort(means, kind="stable")
+        means, weights = means[order], weights[order]
+        cumulative = np.cumsum(weights)
+        q_mid = (cumulative - weights / 2) / cumulative[-1]
+        groups = np.floor(self._scale(q_mid) - self._scale(0)).astype(np.int64)
+        _, groups = np.unique(groups, return_inverse=True)
+        group_weights = np.bincount(groups, weights=weights)
+        self.means = np.bincount(groups, weights=means * weights) / group_weights
+        self.weights = group_weights
+
+    def update(self, values):
+        """
+        Add a batch of values to the sketch.
+        :param values: Array-like of values.
+        """
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if len(values) == 0:
+            return
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        self._compress(
+            np.concatenate([self.means, values]),
+            np.concatenate([self.weights, np.ones(len(values))]),
+        )
+
+    def merge(self, other):
+        """
+        Merge another TDigest into this one.
+        :param other: TDigest to merge.
+        """
+        if len(other.weights) == 0:
+            return
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress(
+            np.concatenate([self.means, other.means]),
+            np.concatenate([self.weights, other.weights]),
+        )
+
+    def quantile(self, q):
+        """
+        Estimate a quantile.
+        :param q: Quantile in [0, 1].
+        :return: Estimated value.
+        """
+        if len(self.weights) == 0:
+            return np.nan
+        if len(self.weights) == 1:
+            return self.means[0]
+        cumulative = np.cumsum(self.weights)
+        positions = cumulative - self.weights / 2
+        return float(
+            np.interp(
+                q * cumulative[-1],
+                np.concatenate([[0], positions, [cumulative[-1]]]),
+                np.concatenate([[self.min], self.means, [self.max]]),
+            )
+        )
@@ -1,3 +1,5 @@
+import os
+import time
 import pytest
 import pandas as pd
 from src.side_effect.side_effect import (
@@ -5,9 +7,49 @@ from src.side_effect.side_effect import (
     get_drugs,
     get_comment_dict,
     remove_comment,
+    merge_data,
+    remove_near_duplicates,
+    pick_drug,
 )
-from src.side_effect.analysis import comment_side_effect
+from src.side_effect.analysis import (
+    comment_side_effect,
+    cascade_candidates,
+    fill_similarity,
+    stratify,
+    sampled_side_effects,
+    ranking_is_stable,
+    stratified_sample_order,
+    get_comment_similarity,
+    evaluate_score,
+    out_of_core_side_effects,
+    keyword_weight_matrix,
+    tile_rows_for_budget,
+)
+from src.side_effect.data_processing_reddit import SideEffectProcessor
+from src.side_effect.comment_store import CommentStore
+from src.side_effect.tdigest import TDigest
+from src.side_effect.sharding import (
+    split_shards,
+    enqueue_shards,
+    claim_task,
+    complete_task,
+    requeue_stale,
+)
+from src.side_effect.review_db import ReviewDatabase
+from src.side_effect.result_writers import DrugResult, get_writer
+from src.side_effect.lexical_index import InvertedIndex
+from src.side_effect.planner import forward_seconds
+from src.side_effect.pq import ProductQuantizer, normalize
+from src.side_effect.result_cache import ResultCache
+from src.side_effect.cooccurrence import (
+    match_matrix,
+    cooccurrence_counts,
+    pair_statistics,
+    drug_similarity,
+)
+from src.side_effect import analysis
 import string
+import numpy as np
 
 
 def load_test_data():
@@ -81,3 +123,535 @@ def test_comment_side_effect():
     )
     assert len(top_k_comments) == 2
     assert "nausea" in drug_dict[0]["side_effects"]
+
+
+def test_process_directory_skips_unchanged(tmp_path):
+    raw_dir = tmp_path / "raw"
+    raw_dir.mkdir()
+    pd.DataFrame(
+        {
+            "Post Title": ["Bad nausea", "Bad nausea", "Sleep?"],
+            "Comment": ["Same here!", "[deleted]", "Insomnia-ish 2 nights"],
+        }
+    ).to_csv(raw_dir / "reddit_adderall.csv", index=False)
+    processor = SideEffectProcessor(str(raw_dir), str(tmp_path / "cleaned"))
+
+    assert processor.process_directory() == ["reddit_adderall.csv"]
+    output = pd.read_csv(tmp_path / "cleaned" / "reddit_adderall.csv")
+    assert list(output["Review Text"]) == [
+        "Bad nausea",
+        "Sleep?",
+        "Same here!",
+        "Insomnia-ish 2 nights",
+    ]
+    assert list(output["cleaned_comments"])[-1] == "insomnia ish  nights"
+    assert processor.process_directory() == []
+
+
+def test_merge_data_cache(tmp_path):
+    test_data = load_test_data()
+    test_data.iloc[:20].to_csv(tmp_path / "part1.csv", index=False)
+    test_data.iloc[20:].to_csv(tmp_path / "part2.csv", index=False)
+    merged = merge_data(str(tmp_path))
+    assert len(merged) == len(test_data)
+    assert merged["Drug Name"].dtype == "category"
+    assert (tmp_path / ".merged_cache.pkl").exists()
+    cached = merge_data(str(tmp_path))
+    assert cached.equals(merged)
+
+
+def test_remove_near_duplicates():
+    comment = "this medication gave me terrible nausea every single morning"
+    df = pd.DataFrame(
+        {
+            "Drug Name": ["adderall", "adderall", "ritalin", "adderall"],
+            "cleaned_comments": [
+                comment,
+                comment + " lol",
+                comment,
+                "i could not sleep for three days",
+            ],
+        }
+    )
+    deduplicated = remove_near_duplicates(df, threshold=0.7)
+    assert list(deduplicated.index) == [0, 2, 3]
+    assert list(deduplicated["duplicate_count"]) == [2, 1, 1]
+
+
+def test_cascade_candidates_and_fill():
+    expanded_keywords = {"nausea": [{"nausea": 1.0}]}
+    static_similarity = {"nausea": np.array([0.1, 0.9, 0.5, 0.2, 0.8])}
+    candidates = cascade_candidates(
+        {"nausea": static_similarity}, expanded_keywords, 0.4, 5
+    )
+    assert list(candidates) == [1, 4]
+    filled = fill_similarity(
+        {"nausea": np.array([0.7, 0.6])}, static_similarity, candidates, 5
+    )
+    assert filled["nausea"][1] == 0.7 and filled["nausea"][4] == 0.6
+    assert all(filled["nausea"][[0, 2, 3]] <= 0.6)
+
+
+def test_comment_store_drug_view():
+    test_data = load_test_data()
+    store = CommentStore(test_data)
+    drug_view, comments = pick_drug(store, "concerta")
+    expected = test_data[test_data["Drug Name"] == "concerta"]
+    assert list(comments) == list(expected["cleaned_comments"])
+    comment_similarity = {"nausea": np.linspace(0, 1, len(drug_view))}
+    expanded_keywords = {"nausea": [{"nausea": 1.0}]}
+    drug_view, top_k_comments = comment_side_effect(
+        comment_similarity, "nausea", expanded_keywords, drug_view, top_k=2
+    )
+    assert [item["comment"] for item in top_k_comments] == list(
+        expected["Review Text"].iloc[::-1][:2]
+    )
+    store.drug("ritalin").add_side_effect([0, 1], "fatigue")
+    assert len(drug_view.side_effect_idx("fatigue")) == 0
+    records = drug_view.to_records()
+    assert list(drug_view.side_effect_idx("nausea")) == [
+        i for i, record in enumerate(records) if record["side_effects"]
+    ]
+    assert records[-1]["side_effects"] == ["nausea"]
+    assert records[0]["side_effects"] == []
+    drug_view.clear_side_effects()
+    assert all(record["side_effects"] == [] for record in drug_view.to_records())
+    assert store.drug("ritalin").to_records()[0]["side_effects"] == ["fatigue"]
+
+
+def test_tdigest_median():
+    values = np.random.default_rng(0).normal(size=100000)
+    digest, other = TDigest(), TDigest()
+    for i, chunk in enumerate(np.array_split(values, 20)):
+        (digest if i % 2 else other).update(chunk)
+    digest.merge(other)
+    assert len(digest.weights) <= digest.compression
+    assert abs((values < digest.quantile(0.5)).mean() - 0.5) < 0.01
+
+
+def test_split_shards_and_claim(tmp_path):
+    shards = split_shards({"adderall": 100, "ritalin": 60, "concerta": 50}, 2)
+    assert shards == [["adderall"], ["ritalin", "concerta"]]
+    enqueue_shards(str(tmp_path), shards, ["nausea"])
+    claimed = [claim_task(str(tmp_path)) for _ in range(3)]
+    assert [task["drugs"] for _, task in claimed[:2]] == shards
+    assert claimed[2] is None
+    run = pd.read_json(tmp_path / "run.json", typ="series")
+    assert run["drugs"] == ["adderall", "ritalin", "concerta"]
+
+
+def test_claimed_task_survives_requeue(tmp_path):
+    queue_dir = str(tmp_path)
+    enqueue_shards(queue_dir, [["adderall"]], ["nausea"])
+    todo_path = tmp_path / "todo" / "shard_00000.json"
+    enqueued = time.time() - 7 * 3600
+    os.utime(todo_path, (enqueued, enqueued))
+    claimed_path, _ = claim_task(queue_dir)
+    assert requeue_stale(queue_dir) == 0
+    # A claim taken back (e.g. after a missed heartbeat) does not fail completion
+    os.utime(claimed_path, (enqueued, enqueued))
+    assert requeue_stale(queue_dir) == 1
+    assert not complete_task(queue_dir, claimed_path)
+    claimed_path, _ = claim_task(queue_dir)
+    assert complete_task(queue_dir, claimed_path)
+
+
+def test_review_database(tmp_path):
+    test_data = load_test_data()
+    db = ReviewDatabase(str(tmp_path / "reviews.db"))
+    db.build(test_data)
+    assert set(db.drugs()) == set(get_drugs(test_data))
+    reviews = db.load_reviews(["concerta"])
+    assert len(reviews) == (test_data["Drug Name"] == "concerta").sum()
+    matches = db.search("fatigue", drug="concerta")
+    assert len(matches) == 1
+    embeddings = np.random.default_rng(0).random((2, 4)).astype(np.float32)
+    db.save_embeddings(reviews["review_id"][:2], embeddings, "model")
+    ids, loaded = db.load_embeddings(reviews["review_id"], "model")
+    assert list(ids) == list(reviews["review_id"][:2])
+    assert np.array_equal(loaded, embeddings)
+    assert list(db.embedded_ids("model")) == list(reviews["review_id"][:2])
+    version = db.data_version()
+    db.build(test_data.iloc[1:])
+    assert db.data_version() != version
+
+
+def test_result_writers_append(tmp_path):
+    results = [
+        DrugResult(
+            drug,
+            [{"Drug Name": drug, "cleaned_comments": "tired", "side_effects": []}],
+            {"fatigue": score, "nausea": score / 2},
+            [{"drug": drug, "side_effect": "fatigue", "comment": "tired"}],
+        )
+        for drug, score in [("concerta", 0.8), ("adderall", 0.4)]
+    ]
+    with get_writer("csv", str(tmp_path)) as writer:
+        for result in results:
+            writer.write(result)
+    scores = pd.read_csv(tmp_path / "side_effect_scores.csv")
+    assert list(scores["drug"]) == ["concerta", "concerta", "adderall", "adderall"]
+    assert len(pd.read_csv(tmp_path / "top_k_comments.csv")) == 2
+    with get_writer("json", str(tmp_path)) as writer:
+        for result in results:
+            writer.write(result)
+    assert len(pd.read_json(tmp_path / "new_comment_dict.jsonl", lines=True)) == 2
+
+
+@pytest.mark.parametrize("output_format", ["csv", "parquet"])
+def test_result_writers_align_columns(tmp_path, output_format):
+    if output_format == "parquet":
+        pytest.importorskip("pyarrow")
+    scores = {"fatigue": 0.8}
+    results = [
+        DrugResult("concerta", [], scores, [], {"fatigue": (0.7, 0.9)}),
+        DrugResult("adderall", [], scores, []),
+    ]
+    with get_writer(output_format, str(tmp_path)) as writer:
+        for result in results:
+            writer.write(result)
+    path = tmp_path / f"side_effect_scores.{output_format}"
+    table = pd.read_csv(path) if output_format == "csv" else pd.read_parquet(path)
+    assert list(table.columns) == [
+        "drug",
+        "side_effect",
+        "score",
+        "ci_lower",
+        "ci_upper",
+    ]
+    assert list(table["score"]) == [0.8, 0.8]
+    assert table["ci_upper"].iloc[0] == 0.9 and pd.isna(table["ci_upper"].iloc[1])
+    # Columns cannot be added to a header that is already written
+    with get_writer(output_format, str(tmp_path / "reversed")) as writer:
+        writer.write(results[1])
+        with pytest.raises(ValueError):
+            writer.write(results[0])
+
+
+def test_result_cache_lru_and_invalidation(tmp_path):
+    data_path = tmp_path / "reviews.csv"
+    data_path.write_text("Drug Name,Review Text\nconcerta,tired\n")
+    cache = ResultCache(str(tmp_path / "cache"), max_size_mb=1)
+    version = cache.data_version(str(data_path))
+    keys = [
+        ResultCache.key(data=version, drug="concerta", side_effect=kw)
+        for kw in ["fatigue", "nausea", "headache"]
+    ]
+    entry = {"score": 0.5, "top_k_comments": [], "matched": np.arange(60000)}
+    cache.put(keys[0], entry, version)
+    cache.put(keys[1], entry, version)
+    assert cache.get(keys[0])["score"] == 0.5
+    cache.put(keys[2], entry, version)  # over 1 MB: evicts keys[1]
+    assert cache.get(keys[1]) is None
+    cache.save()
+
+    cache = ResultCache(str(tmp_path / "cache"), max_size_mb=1)
+    assert cache.get(keys[0]) is not None and cache.get(keys[2]) is not None
+    data_path.write_text("Drug Name,Review Text\nconcerta,very tired\n")
+    assert cache.data_version(str(data_path)) != version
+    assert cache.get(keys[0]) is None and not cache.entries
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_cooccurrence_and_drug_similarity():
+    side_effects = ["fatigue", "nausea", "headache"]
+    lists = [["fatigue", "nausea"], ["fatigue", "nausea"], ["headache"], ["fatigue"]]
+    matches = match_matrix(lists + [["unknown"]], side_effects)
+    counts = cooccurrence_counts(matches, chunk_rows=2)
+    assert counts.tolist() == [[3, 2, 0], [2, 2, 0], [0, 0, 1]]
+    assert np.array_equal(cooccurrence_counts(matches, dense_threshold=1), counts)
+    pairs = pair_statistics(counts, 5, side_effects)
+    assert len(pairs) == 1  # pairs never reported together are dropped
+    row = pairs.iloc[0]
+    assert (row["side_effect_a"], row["side_effect_b"]) == ("fatigue", "nausea")
+    assert np.isclose(row["lift"], (2 / 5) / (3 / 5 * 2 / 5))
+    assert np.isclose(row["npmi"], np.log(row["lift"]) / -np.log(2 / 5))
+
+    scores = {
+        "concerta": {"fatigue": 0.9, "nausea": 0.2, "headache": 0.5},
+        "ritalin": {"fatigue": 0.8, "nausea": 0.3, "headache": 0.5},
+        "adderall": {"fatigue": 0.1, "nausea": 0.9, "headache": 0.5},
+    }
+    similarity = drug_similarity(scores, side_effects)
+    assert np.allclose(np.diag(similarity), 1)
+    assert (
+        similarity.loc["concerta", "ritalin"] > similarity.loc["concerta", "adderall"]
+    )
+
+
+def test_inverted_index_bm25():
+    comments = ["felt nausea nausea today", "no problems", "mild nausea", "headache"]
+    index = InvertedIndex(comments, groups=["a", "a", "b", "b"])
+    docs, tf = index.postings("nausea")
+    assert list(docs) == [0, 2] and list(tf) == [2, 1]
+    scores = index.bm25("Nausea")
+    assert scores[0] > scores[2] > 0 and scores[1] == scores[3] == 0
+    assert np.allclose(index.bm25("nausea", 2, 4), scores[2:4])
+    stats = index.term_stats("a").set_index("term")
+    assert stats.loc["nausea", "tf"] == 2 and stats.loc["nausea", "df"] == 1
+    assert "headache" not in stats.index
+
+
+def test_sampled_side_effects():
+    rng = np.random.default_rng(0)
+    n_comments = 5000
+    true_means = np.array([0.9, 0.7, 0.5, 0.3, 0.1])
+    values = true_means + rng.normal(0, 0.2, (n_comments, len(true_means)))
+    strata = stratify(rng.integers(5, 200, n_comments))
+    keywords = ["a", "b", "c", "d", "e"]
+    scores, intervals, sample, _ = sampled_side_effects(
+        lambda idx: values[idx], strata, keywords, k=1, initial_size=100
+    )
+    assert len(sample) < n_comments
+    exact = values.mean(axis=0)
+    for kw, mean in zip(keywords, exact):
+        lower, upper = intervals[kw]
+        assert lower <= mean <= upper
+    # Close rankings are sampled until every comment is scored, which is exact
+    scores, intervals, sample, _ = sampled_side_effects(
+        lambda idx: np.zeros((len(idx), 2)), strata, ["a", "b"], k=1
+    )
+    assert len(sample) == n_comments and intervals["a"] == (0.0, 0.0)
+
+
+def test_out_of_core_matches_in_memory():
+    initial_keywords = ["nausea", "fatigue"]
+    expanded_keywords = {
+        "nausea": [{"nausea": 1.0}, {"vomiting": 0.8}],
+        "fatigue": [{"fatigue": 1.0}, {"tired": 0.7}],
+    }
+    kw_embeddings, weights = keyword_weight_matrix(initial_keywords, expanded_keywords)
+    rng = np.random.default_rng(0)
+    n_comments, dim = 101, kw_embeddings.shape[1]
+    # Comments near a random mix of keywords, so scores vary across comments
+    embeddings = rng.random((n_comments, len(kw_embeddings))) @ kw_embeddings
+    embeddings += rng.normal(0, 0.05, (n_comments, dim))
+    memory_budget_mb = 0.01
+    tile_rows = tile_rows_for_budget(
+        memory_budget_mb, dim, len(kw_embeddings), len(initial_keywords)
+    )
+    assert tile_rows < n_comments // 2
+    scores, top_k, assignments = out_of_core_side_effects(
+        embeddings,
+        initial_keywords,
+        expanded_keywords,
+        memory_budget_mb=memory_budget_mb,
+        top_k=5,
+    )
+    for kw in initial_keywords:
+        drug_dict = [
+            {"Drug Name": "drug", "Review Text": i, "side_effects": []}
+            for i in range(n_comments)
+        ]
+        similarity = get_comment_similarity(kw, expanded_keywords, embeddings)
+        assert scores[kw] == pytest.approx(
+            evaluate_score(similarity, kw, expanded_keywords)
+        )
+        drug_dict, top_k_comments = comment_side_effect(
+            similarity, kw, expanded_keywords, drug_dict, top_k=5
+        )
+        matched = [i for i, row in enumerate(drug_dict) if row["side_effects"]]
+        assert list(assignments[kw]) == matched
+        assert [int(i) for i, _ in top_k[kw]] == [
+            item["comment"] for item in top_k_comments
+        ]
+
+
+def test_keyword_embeddings_use_given_embedder():
+    class WordEmbedder:
+        vectors = {"nausea": [1.0, 0.0], "vomiting": [0.0, 2.0]}
+
+        def get_embeddings(self, text):
+            return np.array([self.vectors[text]])
+
+    expanded_keywords = {"nausea": [{"nausea": 1.0}, {"vomiting": 0.5}]}
+    comment_embeddings = np.array([[1.0, 0.0], [0.0, 1.0]])
+    similarity = get_comment_similarity(
+        "nausea", expanded_keywords, comment_embeddings, embedder=WordEmbedder()
+    )
+    assert np.allclose(similarity["vomiting"], [0.0, 1.0])
+    kw_embeddings, weights = keyword_weight_matrix(
+        ["nausea"], expanded_keywords, WordEmbedder()
+    )
+    assert np.allclose(kw_embeddings, np.eye(2))
+    assert np.allclose(weights, [[1.0], [0.5]])
+
+
+def test_ranking_is_stable_checks_order():
+    means = np.array([0.9, 0.8, 0.5, 0.2, 0.1])
+    lower, upper = means - 0.02, means + 0.02
+    assert ranking_is_stable(means, lower, upper, k=2)
+    # The top set is separated from the rest, but its two ranks overlap
+    upper[1] = 0.95
+    assert not ranking_is_stable(means, lower, upper, k=2)
+    # Fewer side effects than k: the whole ranking must be determined
+    means = np.array([0.5, 0.45])
+    assert not ranking_is_stable(means, means - 0.1, means + 0.1, k=5)
+    assert ranking_is_stable(means, means - 0.01, means + 0.01, k=5)
+
+
+def test_stratified_sample_order_covers_strata():
+    strata = np.array([0] * 1000 + [1] * 3 + [2])
+    order = stratified_sample_order(strata)
+    assert set(strata[order[:3]]) == {0, 1, 2}
+    assert sorted(order) == list(range(len(strata)))
+
+
+def test_forward_seconds():
+    # 1 ms per pass plus 0.01 ms per token
+    calibration = np.array([0.0, 1e-5, 1e-3])
+    assert np.isclose(forward_seconds(calibration, [100, 300]), 0.006)
+    assert forward_seconds(calibration, []) == 0
+
+
+def test_product_quantizer(tmp_path):
+    rng = np.random.default_rng(0)
+    embeddings = rng.normal(size=(600, 32)).astype(np.float32)
+    queries = rng.normal(size=(3, 32)).astype(np.float32)
+    pq = ProductQuantizer(n_subspaces=8, n_centroids=16, n_iter=5).fit(embeddings)
+    codes = pq.encode(embeddings)
+    assert codes.shape == (600, 8) and codes.dtype == np.uint8
+    # Asymmetric scores equal exact similarities to the reconstructed vectors
+    approx = pq.similarities(codes, queries)
+    assert np.allclose(approx, pq.decode(codes) @ normalize(queries).T, atol=1e-5)
+    exact = normalize(embeddings) @ normalize(queries).T
+    assert np.corrcoef(approx.ravel(), exact.ravel())[0, 1] > 0.8
+    pq.save(tmp_path / "pq.npz")
+    assert np.array_equal(
+        ProductQuantizer.load(tmp_path / "pq.npz").encode(embeddings), codes
+    )
+
+
+def test_pq_mode_with_small_corpus(tmp_path, monkeypatch):
+    store = CommentStore(load_test_data())
+    monkeypatch.chdir(tmp_path)
+    from src.side_effect.apply import SideEffectAnalyzer
+
+    analyzer = SideEffectAnalyzer(
+        ["fatigue"], [], pq=True, pq_subspaces=4, embedding_dir=str(tmp_path)
+    )
+    analyzer.train_pq(store)
+    assert analyzer.pq_codec.n_centroids == len(store) < 256
+    drug_view, comments = pick_drug(store, "concerta")
+    expanded_keywords = {"fatigue": [{"fatigue": 1.0}, {"tired": 0.8}]}
+    similarities, rerank_fns = analyzer.pq_similarities(
+        "concerta", comments, expanded_keywords
+    )
+    assert len(similarities["fatigue"]["tired"]) == len(comments)
+    assert len(rerank_fns["fatigue"](np.array([1, 0]))) == 2
+    # Codes are reused from disk, and no float embeddings are kept
+    passes = analyzer.n_forward_passes
+    cached, _ = analyzer.pq_similarities("concerta", comments, expanded_keywords)
+    assert analyzer.n_forward_passes == passes
+    assert np.array_equal(cached["fatigue"]["tired"], similarities["fatigue"]["tired"])
+    assert sorted(os.listdir(analyzer.pq_dir)) == ["codec.npz", "concerta.npy"]
+    assert not (tmp_path / "concerta.npy").exists()
+    analyzer.pq_similarities("a/../b", comments, expanded_keywords)
+    assert len(os.listdir(analyzer.pq_dir)) == 3
+    # Another data version gets its own codec and codes
+    pq_dir = analyzer.pq_dir
+    analyzer.train_pq(store, "0" * 64)
+    assert analyzer.pq_dir != pq_dir
+    assert os.listdir(analyzer.pq_dir) == ["codec.npz"]
+
+
+def test_embed_batch_matches_and_shrinks(monkeypatch):
+    embedder = analysis.embedder
+    texts = list(load_test_data()["cleaned_comments"][:6])
+    single = np.vstack([embedder.get_embeddings(text)[0] for text in texts])
+    monkeypatch.setattr(embedder, "batch_size", 4)
+    monkeypatch.setattr(embedder, "max_tokens", 8192)
+    assert np.allclose(embedder.embed_batch(texts), single, atol=1e-4)
+
+    forward = embedder._forward
+
+    def limited_forward(token_ids):
+        if len(token_ids) > 1:
+            raise RuntimeError("DefaultCPUAllocator: not enough memory")
+        return forward(token_ids)
+
+    monkeypatch.setattr(embedder, "_forward", limited_forward)
+    assert np.allclose(embedder.embed_batch(texts), single, atol=1e-4)
+    assert embedder.batch_size == 1
+
+
+def test_checkpoint_resume_and_invalidation(tmp_path, monkeypatch):
+    test_data = load_test_data()
+    data_path = tmp_path / "reviews.csv"
+    test_data.to_csv(data_path, index=False)
+    # apply logs to logs.txt in the working directory on import
+    monkeypatch.chdir(tmp_path)
+    from src.side_effect.apply import SideEffectAnalyzer
+
+    analyzer = SideEffectAnalyzer(["fatigue"], [])
+    run_dir = str(tmp_path / "run")
+    signature = analyzer.run_signature(analyzer.data_version(str(data_path)))
+    comments = [{"Drug Name": "kapvay", "cleaned_comments": "tired"}]
+    analyzer.save_checkpoint(
+        run_dir, "kapvay", signature, comments, {"fatigue": 0.5}, []
+    )
+    results = list(
+        analyzer.iter_results(
+            str(data_path), ["kapvay"], ["fatigue"], run_dir=run_dir, resume=True
+        )
+    )
+    assert analyzer.n_forward_passes == 0
+    assert results[0].scores == {"fatigue": 0.5}
+    assert results[0].comments == comments
+
+    analyzer.initial_keywords = ["nausea"]
+    assert analyzer.load_checkpoint(run_dir, "kapvay", signature) is None
+    analyzer.initial_keywords = ["fatigue"]
+    test_data.iloc[1:].to_csv(data_path, index=False)
+    changed = analyzer.run_signature(analyzer.data_version(str(data_path)))
+    assert analyzer.load_checkpoint(run_dir, "kapvay", changed) is None
+    analyzer.top_k = 5
+    assert (
+        analyzer.load_checkpoint(
+            run_dir, "kapvay", analyzer.run_signature(signature["data"])
+        )
+        is None
+    )
+    # Drug names are not trusted as file names
+    for drug in [
+        "amphetamine/dextroamphetamine",
+        "..",
+        "amphetamine_dextroamphetamine",
+    ]:
+        analyzer.save_checkpoint(run_dir, drug, signature, [], {"fatigue": 0.1}, [])
+    names = os.listdir(os.path.join(run_dir, "drugs"))
+    assert len(names) == 4 and not any(name.startswith(".") for name in names)
+    checkpoint = analyzer.load_checkpoint(
+        run_dir, "amphetamine/dextroamphetamine", signature
+    )
+    assert checkpoint["drug"] == "amphetamine/dextroamphetamine"
+
+
+def test_joint_mode_cache_rescores_full_set(tmp_path, monkeypatch):
+    # All comments as one drug, so the cascade candidates depend on the set
+    test_data = load_test_data().assign(**{"Drug Name": "combo"})
+    data_path = str(tmp_path / "reviews.csv")
+    test_data.to_csv(data_path, index=False)
+    monkeypatch.chdir(tmp_path)
+    from src.side_effect.apply import SideEffectAnalyzer
+
+    keywords = ["fatigue", "nausea", "headache"]
+    cache = ResultCache(str(tmp_path / "cache"))
+    analyzer = SideEffectAnalyzer(
+        keywords, [], cascade=True, cascade_fraction=0.05, result_cache=cache
+    )
+    monkeypatch.setattr(
+        analyzer.keyword_expander,
+        "expand_keywords",
+        lambda kws: {kw: [{kw: 1.0}] for kw in kws},
+    )
+    list(analyzer.iter_results(data_path, ["combo"], keywords))
+    cache.remove(sorted(cache.entries)[0])
+    (cached,) = analyzer.iter_results(data_path, ["combo"], keywords)
+    analyzer.result_cache = None
+    (uncached,) = analyzer.iter_results(data_path, ["combo"], keywords)
+    assert cached.scores == pytest.approx(uncached.scores)
+    assert cached.top_k_comments == uncached.top_k_comments
+    assert [row["side_effects"] for row in cached.comments] == [
+        row["side_effects"] for row in uncached.comments
+    ]